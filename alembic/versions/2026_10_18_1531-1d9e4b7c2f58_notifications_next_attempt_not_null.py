@@ -0,0 +1,29 @@
+"""Notifications next attempt not null
+
+Revision ID: 1d9e4b7c2f58
+Revises: c6f1a8d3e472
+Create Date: 2026-10-18 15:31:12.640385
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1d9e4b7c2f58'
+down_revision: Union[str, None] = 'c6f1a8d3e472'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("UPDATE notifications SET next_attempt_at = created_at WHERE next_attempt_at IS NULL")
+    with op.batch_alter_table('notifications') as batch_op:
+        batch_op.alter_column('next_attempt_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('notifications') as batch_op:
+        batch_op.alter_column('next_attempt_at', existing_type=sa.DateTime(), nullable=True)
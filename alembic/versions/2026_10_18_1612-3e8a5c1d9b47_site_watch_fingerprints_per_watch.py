@@ -0,0 +1,55 @@
+"""Site watch fingerprints per watch
+
+Revision ID: 3e8a5c1d9b47
+Revises: 1d9e4b7c2f58
+Create Date: 2026-10-18 16:12:08.314592
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e8a5c1d9b47'
+down_revision: Union[str, None] = '1d9e4b7c2f58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Old rows are raw body hashes per url, they can't be compared with content fingerprints.
+    # "changed" watches start over, their first check records the fingerprint without notifying.
+    op.drop_index(op.f('ix_site_watch_fingerprints_id'), table_name='site_watch_fingerprints')
+    op.drop_table('site_watch_fingerprints')
+    op.create_table('site_watch_fingerprints',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('target', sa.String(), nullable=False),
+    sa.Column('url', sa.String(), nullable=False),
+    sa.Column('watch', sa.String(), nullable=False),
+    sa.Column('fingerprint', sa.String(), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('target', 'url', 'watch')
+    )
+    op.create_index(op.f('ix_site_watch_fingerprints_id'), 'site_watch_fingerprints', ['id'], unique=False)
+    op.add_column('site_watch_http_cache', sa.Column('fingerprint', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('site_watch_http_cache') as batch_op:
+        batch_op.drop_column('fingerprint')
+    op.drop_index(op.f('ix_site_watch_fingerprints_id'), table_name='site_watch_fingerprints')
+    op.drop_table('site_watch_fingerprints')
+    op.create_table('site_watch_fingerprints',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('url', sa.String(), nullable=False),
+    sa.Column('fingerprint', sa.String(), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('url')
+    )
+    op.create_index(op.f('ix_site_watch_fingerprints_id'), 'site_watch_fingerprints', ['id'], unique=False)
@@ -0,0 +1,81 @@
+"""
+Broadcast fan-out latency against the number of cctl connections.
+
+Connections are in-memory fake WebSockets, so only the server-side cost is measured:
+frame encoding, task scheduling and response routing. Each client answers after a random delay,
+a fraction of them never answers (hung device). Run:
+
+    python -m benchmarks.cctl_broadcast --connections 10 100 1000 5000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from kotiki.api import bot_api
+from kotiki.api.bot_api import CCTL_PROTOCOL_LEGACY, CCTL_PROTOCOL_REQUEST_ID, CctlConnection, CctlConnectionManager
+from kotiki.core.metrics import percentile
+
+
+class FakeWebSocket:
+    def __init__(self, max_delay: float, hung: bool):
+        self.connection: CctlConnection | None = None
+        self._max_delay = max_delay
+        self.hung = hung
+
+    async def send_text(self, frame: str):
+        if not self.hung:
+            asyncio.get_running_loop().call_later(random.uniform(0, self._max_delay), self._respond, frame)
+
+    def _respond(self, frame: str):
+        data = json.loads(frame)
+        response = {"ok": True}
+        if "request_id" in data:
+            response["request_id"] = data["request_id"]
+        self.connection.deliver_response(response)
+
+
+def make_manager(
+    connections: int, max_delay: float, hung_ratio: float, legacy_ratio: float,
+) -> tuple[CctlConnectionManager, int]:
+    manager = CctlConnectionManager()
+    hung = 0
+    for i in range(connections):
+        websocket = FakeWebSocket(max_delay, hung=random.random() < hung_ratio)
+        hung += websocket.hung
+        protocol = CCTL_PROTOCOL_LEGACY if random.random() < legacy_ratio else CCTL_PROTOCOL_REQUEST_ID
+        connection = CctlConnection(websocket=websocket, client_id=str(i), protocol=protocol)
+        websocket.connection = connection
+        manager.register(str(i), connection)
+    return manager, hung
+
+
+async def bench(connections: int, args: argparse.Namespace) -> str:
+    manager, hung = make_manager(connections, args.max_delay, args.hung_ratio, args.legacy_ratio)
+    started = time.perf_counter()
+    arrivals = []
+    async for _ in manager.broadcast_iter({"start": True}):
+        arrivals.append(time.perf_counter() - started)
+    answered = arrivals[:len(arrivals) - hung] or arrivals
+    return "{:>6} conns: first={:.4f}s p50={:.4f}s p99={:.4f}s all answered={:.4f}s done={:.2f}s".format(
+        connections, arrivals[0], percentile(arrivals, 50), percentile(arrivals, 99), answered[-1], arrivals[-1],
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--max-delay", type=float, default=0.05, help="Max client response delay, seconds")
+    parser.add_argument("--hung-ratio", type=float, default=0.0, help="Share of clients that never answer")
+    parser.add_argument("--legacy-ratio", type=float, default=0.5, help="Share of protocol 1 clients")
+    parser.add_argument("--response-timeout", type=float, default=bot_api.CCTL_RESPONSE_TIMEOUT)
+    args = parser.parse_args()
+    bot_api.CCTL_RESPONSE_TIMEOUT = args.response_timeout
+    random.seed(0)
+    for connections in args.connections:
+        print(await bench(connections, args))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
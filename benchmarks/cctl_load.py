@@ -0,0 +1,262 @@
+"""
+Load test of the cctl WebSocket API with many simulated clients.
+
+Starts the bot API app in-process on a local port and connects N clients with correct hashes.
+Clients answer commands after a random delay; a share of them never answers (timeout) or drops
+the connection when commanded (disconnect). Reports:
+
+- connect throughput
+- memory per connection: Python allocations in server-side packages, via tracemalloc
+- broadcast latency: first / median / last answer, per round
+- send_to_id latency percentiles
+- event loop lag while commands run
+
+Clients share the event loop with the server, so the numbers are an upper bound of server cost. Run:
+
+    python -m benchmarks.cctl_load --clients 100 1000
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import resource
+import time
+import tracemalloc
+
+import aiohttp
+import uvicorn
+
+from kotiki.api import bot_api
+from kotiki.api.cctl_codecs import CctlCodec, get_codec
+from kotiki.core.metrics import percentile
+
+SECRET = "benchmark"
+SERVER_PACKAGES = ("/kotiki/", "/starlette/", "/fastapi/", "/uvicorn/", "/websockets/", "/wsproto/", "/h11/")
+
+
+class SimulatedClient:
+    def __init__(self, client_id: str, protocol: int, max_delay: float, behavior: str, codec: CctlCodec):
+        self.client_id = client_id
+        self.protocol = protocol
+        self.codec = codec
+        self.max_delay = max_delay
+        # "answer", "timeout" or "disconnect"
+        self.behavior = behavior
+        self.ws: aiohttp.ClientWebSocketResponse | None = None
+        self._task: asyncio.Task | None = None
+
+    def url(self, port: int) -> str:
+        digest = hashlib.sha1((SECRET + self.client_id).encode()).hexdigest()
+        return "ws://127.0.0.1:{}/bot_api/cctl/{}/{}?protocol={}&codec={}".format(
+            port, digest, self.client_id, self.protocol, self.codec.name,
+        )
+
+    async def _send(self, payload: dict):
+        frame = self.codec.encode(payload)
+        if self.codec.binary:
+            await self.ws.send_bytes(frame)
+        else:
+            await self.ws.send_str(frame)
+
+    async def connect(self, session: aiohttp.ClientSession, port: int):
+        self.ws = await session.ws_connect(self.url(port), autoping=True)
+        self._task = asyncio.create_task(self._serve())
+
+    async def _answer(self, data: dict):
+        await asyncio.sleep(random.uniform(0, self.max_delay))
+        response = {"running": data.get("start")}
+        if "request_id" in data:
+            response["request_id"] = data["request_id"]
+        await self._send(response)
+
+    async def _serve(self):
+        async for message in self.ws:
+            if message.type not in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                continue
+            data = self.codec.decode(message.data)
+            if data.get("type") == bot_api.CCTL_PING_TYPE:
+                await self._send({"type": bot_api.CCTL_PONG_TYPE})
+            elif self.behavior == "disconnect":
+                await self.ws.close()
+                return
+            elif self.behavior == "answer":
+                asyncio.create_task(self._answer(data))
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self._task is not None:
+            self._task.cancel()
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic sleep wakes up, i.e. how long the event loop was blocked"""
+
+    def __init__(self, interval: float = 0.01):
+        self._interval = interval
+        self.samples: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self._interval)
+            self.samples.append(max(0.0, loop.time() - started - self._interval))
+
+    def __enter__(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+def _format_percentiles(name: str, samples: list[float]) -> str:
+    ordered = sorted(samples)
+    if not ordered:
+        return "{}: no samples".format(name)
+    return "{}: p50={:.1f}ms p90={:.1f}ms p99={:.1f}ms max={:.1f}ms".format(
+        name, *(percentile(ordered, p) * 1000 for p in (50, 90, 99)), ordered[-1] * 1000,
+    )
+
+
+def _server_allocated(snapshot: tracemalloc.Snapshot) -> int:
+    return sum(
+        stat.size for stat in snapshot.statistics("traceback")
+        if any(package in frame.filename for frame in stat.traceback for package in SERVER_PACKAGES)
+    )
+
+
+def _make_clients(count: int, args: argparse.Namespace) -> list[SimulatedClient]:
+    clients = []
+    for i in range(count):
+        roll = random.random()
+        if roll < args.timeout_ratio:
+            behavior = "timeout"
+        elif roll < args.timeout_ratio + args.disconnect_ratio:
+            behavior = "disconnect"
+        else:
+            behavior = "answer"
+        protocol = bot_api.CCTL_PROTOCOL_LEGACY if random.random() < args.legacy_ratio \
+            else bot_api.CCTL_PROTOCOL_REQUEST_ID
+        clients.append(SimulatedClient(str(i), protocol, args.max_delay, behavior, get_codec(args.codec)))
+    return clients
+
+
+async def _wait_registered(count: int, timeout: float = 30.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while len(bot_api.cctl_manager.liveness()) != count and loop.time() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def _connect(clients: list[SimulatedClient], session: aiohttp.ClientSession, port: int, concurrency: int):
+    for offset in range(0, len(clients), concurrency):
+        batch = clients[offset:offset + concurrency]
+        await asyncio.gather(*(client.connect(session, port) for client in batch))
+
+
+async def _memory_per_connection(session: aiohttp.ClientSession, port: int, args: argparse.Namespace) -> float:
+    """Server-side allocations of a separate sample of connections, tracemalloc is too slow to run all the time"""
+    sample = [
+        SimulatedClient("memory-{}".format(i), bot_api.CCTL_PROTOCOL_REQUEST_ID, 0, "answer", get_codec(args.codec))
+        for i in range(args.memory_sample)
+    ]
+    registered = len(bot_api.cctl_manager.liveness())
+    tracemalloc.start(25)
+    try:
+        before = _server_allocated(tracemalloc.take_snapshot())
+        await _connect(sample, session, port, args.connect_concurrency)
+        await _wait_registered(registered + len(sample))
+        after = _server_allocated(tracemalloc.take_snapshot())
+    finally:
+        tracemalloc.stop()
+    await asyncio.gather(*(client.close() for client in sample))
+    await _wait_registered(registered)
+    return (after - before) / len(sample)
+
+
+async def run(count: int, port: int, args: argparse.Namespace):
+    clients = _make_clients(count, args)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await _connect(clients, session, port, args.connect_concurrency)
+        await _wait_registered(count)
+        connect_time = time.perf_counter() - started
+        memory = await _memory_per_connection(session, port, args) if args.memory_sample else 0.0
+        print("{} clients: connected in {:.2f}s, {:.0f} conn/s, server memory {:.1f} KiB/conn".format(
+            count, connect_time, count / connect_time, memory / 1024,
+        ))
+
+        with LoopLagMonitor() as lag:
+            firsts, medians, lasts = [], [], []
+            for _ in range(args.rounds):
+                round_started = time.perf_counter()
+                arrivals = []
+                async for _ in bot_api.cctl_manager.broadcast_iter({"start": True}):
+                    arrivals.append(time.perf_counter() - round_started)
+                if arrivals:
+                    firsts.append(arrivals[0])
+                    medians.append(percentile(arrivals, 50))
+                    lasts.append(arrivals[-1])
+            print("  " + _format_percentiles("broadcast first answer", firsts))
+            print("  " + _format_percentiles("broadcast median answer", medians))
+            print("  " + _format_percentiles("broadcast done", lasts))
+
+            latencies = []
+            for _ in range(args.requests):
+                client = random.choice(clients)
+                request_started = time.perf_counter()
+                await bot_api.cctl_manager.send_to_id(client.client_id, {"start": False})
+                latencies.append(time.perf_counter() - request_started)
+            print("  " + _format_percentiles("send_to_id", latencies))
+        print("  " + _format_percentiles("event loop lag", lag.samples))
+        print("  still connected: {}".format(len(bot_api.cctl_manager.liveness())))
+
+        await asyncio.gather(*(client.close() for client in clients))
+    await _wait_registered(0)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--max-delay", type=float, default=0.05, help="Max client response delay, seconds")
+    parser.add_argument("--timeout-ratio", type=float, default=0.0, help="Share of clients that never answer")
+    parser.add_argument("--disconnect-ratio", type=float, default=0.0,
+                        help="Share of clients that disconnect on a command")
+    parser.add_argument("--legacy-ratio", type=float, default=0.0, help="Share of protocol 1 clients")
+    parser.add_argument("--codec", default="json", help="Frame codec: json, orjson or msgpack")
+    parser.add_argument("--response-timeout", type=float, default=2.0)
+    parser.add_argument("--rounds", type=int, default=10, help="Broadcast rounds")
+    parser.add_argument("--requests", type=int, default=100, help="send_to_id requests")
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--memory-sample", type=int, default=50,
+                        help="Connections to measure memory on, 0 to skip")
+    args = parser.parse_args()
+
+    random.seed(0)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    bot_api.configure(api_secret=SECRET)
+    bot_api.CCTL_RESPONSE_TIMEOUT = args.response_timeout
+
+    server = uvicorn.Server(uvicorn.Config(
+        bot_api.app, host="127.0.0.1", port=args.port, log_level="warning", backlog=4096,
+    ))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        for count in args.clients:
+            await run(count, args.port, args)
+    finally:
+        server.should_exit = True
+        await server_task
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
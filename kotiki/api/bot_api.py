@@ -1,15 +1,27 @@
 import asyncio
 import hashlib
+import hmac
 import logging
+import time
+import uuid
 from collections import defaultdict
 from dataclasses import dataclass, field
-from typing import Awaitable, Callable, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+
+from kotiki.api.cctl_codecs import JSON_CODEC, CctlCodec, UnsupportedCodecException, get_codec, negotiate_subprotocol
 
 log = logging.getLogger(__name__)
 
 CCTL_RESPONSE_TIMEOUT = 10.0
+# A stalled socket must not hold up a fan-out: sends time out on their own, and at most this many run at once
+CCTL_SEND_TIMEOUT = 2.0
+CCTL_SEND_CONCURRENCY = 100
+# Protocol 2 clients are pinged when idle for CCTL_HEARTBEAT_INTERVAL and dropped after CCTL_HEARTBEAT_MISSED
+# unanswered pings. Legacy clients don't know pings, they rely on transport-level pings of the server.
+CCTL_HEARTBEAT_INTERVAL = 15.0
+CCTL_HEARTBEAT_MISSED = 2
 
 # Set via configure() from config
 _CCTL_SECRET: str = ""
@@ -23,24 +35,88 @@ def configure(api_secret: str) -> None:
 app = FastAPI(title="Kotiki Bot API")
 
 
+# Protocol 2 (negotiated with ?protocol=2): commands carry "request_id", responses echo it,
+# so a connection can have many commands in flight. Protocol 1 clients get one command at a time.
+CCTL_PROTOCOL_LEGACY = 1
+CCTL_PROTOCOL_REQUEST_ID = 2
+
+
+CCTL_PING_TYPE = "ping"
+CCTL_PONG_TYPE = "pong"
+CCTL_STATE_TYPE = "state"
+
+
 @dataclass
 class CctlConnection:
     """A single cctl WebSocket connection with response waiting."""
 
     websocket: WebSocket
     client_id: str
-    pending_response: Optional[asyncio.Future] = None
+    protocol: int = CCTL_PROTOCOL_LEGACY
+    codec: CctlCodec = JSON_CODEC
+    pending: dict[str, asyncio.Future] = field(default_factory=dict)
+    # Serializes commands for legacy clients, whose responses can't be matched to requests
     lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    connected_at: float = field(default_factory=time.time)
+    # Monotonic time of the last frame received from the client
+    last_seen: float = field(default_factory=time.monotonic)
+    # Set to end the connection's handler, which closes the socket
+    closed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def multiplexed(self) -> bool:
+        return self.protocol >= CCTL_PROTOCOL_REQUEST_ID
+
+    async def send_frame(self, frame: str | bytes) -> None:
+        """Send a frame encoded with the connection's codec"""
+        if self.codec.binary:
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+
+    async def receive(self) -> Any:
+        """Receive and decode a frame. Raises WebSocketDisconnect on disconnect"""
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        data = message.get("bytes")
+        return self.codec.decode(data if data is not None else message["text"])
+
+    def touch(self) -> None:
+        self.last_seen = time.monotonic()
+
+    def idle_time(self) -> float:
+        return time.monotonic() - self.last_seen
+
+    def is_alive(self) -> bool:
+        if not self.multiplexed:
+            return True
+        return self.idle_time() < CCTL_HEARTBEAT_INTERVAL * (CCTL_HEARTBEAT_MISSED + 1)
+
+    def deliver_response(self, data: dict) -> bool:
+        """Deliver received response to its waiter. Returns False if nobody was waiting for it."""
+        request_id = data.pop("request_id", None)
+        if request_id is None:
+            if self.multiplexed or len(self.pending) != 1:
+                return False
+            request_id = next(iter(self.pending))
+        future = self.pending.pop(str(request_id), None)
+        if future is None or future.done():
+            return False
+        try:
+            future.set_result(data)
+        except Exception as e:
+            log.warning("cctl %s: failed to deliver response: %s", self.client_id, e)
+        return True
 
-    def deliver_response(self, data: dict) -> None:
-        """Deliver received response to waiter if any."""
-        if self.pending_response and not self.pending_response.done():
-            try:
-                self.pending_response.set_result(data)
-            except Exception as e:
-                log.warning("cctl %s: failed to deliver response: %s", self.client_id, e)
-            finally:
-                self.pending_response = None
+    def close(self) -> None:
+        self.closed.set()
+
+    def fail_pending(self, exc: BaseException) -> None:
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self.pending.clear()
 
     def __hash__(self) -> int:
         return id(self)
@@ -51,17 +127,67 @@ class CctlConnection:
         return id(self) == id(other)
 
 
+@dataclass
+class CctlState:
+    """Last known state of a cctl client, kept across reconnects"""
+
+    state: dict | None = None
+    # Wall clock times
+    state_updated_at: float | None = None
+    last_error: str | None = None
+    last_error_at: float | None = None
+
+    def update(self, state: dict) -> None:
+        # Responses may carry only part of the state, keep the rest
+        self.state = {**(self.state or {}), **state}
+        self.state_updated_at = time.time()
+
+    def set_error(self, error: str) -> None:
+        self.last_error = error
+        self.last_error_at = time.time()
+
+
 class CctlConnectionManager:
     """Tracks cctl WebSocket connections and supports sending commands with response waiting."""
 
     def __init__(self):
         self._connections: dict[str, set[CctlConnection]] = defaultdict(set)
+        self._states: dict[str, CctlState] = defaultdict(CctlState)
         self._on_unsolicited_error: Optional[Callable[[str, dict], Awaitable[None]]] = None
 
     def set_on_unsolicited_error(self, callback: Callable[[str, dict], Awaitable[None]]) -> None:
         """Set callback for errors received outside response-waiting context. Called with (client_id, error_data)."""
         self._on_unsolicited_error = callback
 
+    def update_state(self, client_id: str, state: dict) -> None:
+        """Remember client's state, from a command response or a state report"""
+        self._states[client_id].update(state)
+
+    def set_error(self, client_id: str, error: str) -> None:
+        self._states[client_id].set_error(error)
+
+    def fleet_status(self) -> list[dict]:
+        """
+        Status of all known clients from the cache, without contacting them:
+        [{"client_id": str, "connections": int, "alive": bool, "idle": float | None, "state": dict | None,
+          "state_updated_at": float | None, "last_error": str | None, "last_error_at": float | None}]
+        """
+        result = []
+        for client_id in sorted(set(self._connections) | set(self._states)):
+            conns = list(self._connections.get(client_id, ()))
+            state = self._states.get(client_id, CctlState())
+            result.append({
+                "client_id": client_id,
+                "connections": len(conns),
+                "alive": any(conn.is_alive() for conn in conns),
+                "idle": min((conn.idle_time() for conn in conns), default=None),
+                "state": state.state,
+                "state_updated_at": state.state_updated_at,
+                "last_error": state.last_error,
+                "last_error_at": state.last_error_at,
+            })
+        return result
+
     def register(self, client_id: str, connection: CctlConnection) -> None:
         self._connections[client_id].add(connection)
 
@@ -69,76 +195,148 @@ class CctlConnectionManager:
         self._connections[client_id].discard(connection)
         if not self._connections[client_id]:
             del self._connections[client_id]
-        if connection.pending_response and not connection.pending_response.done():
-            connection.pending_response.set_exception(ConnectionError("Connection closed"))
+        connection.fail_pending(ConnectionError("Connection closed"))
+
+    def drop(self, client_id: str, connection: CctlConnection) -> None:
+        """Unregister a broken connection and close it, so that the client notices and reconnects"""
+        self.unregister(client_id, connection)
+        connection.close()
+
+    @staticmethod
+    def _result(client_id: str, ok: bool, response: dict | None, error: str | None) -> dict:
+        return {"client_id": client_id, "ok": ok, "response": response, "error": error}
 
     async def _send_to_connection(
-        self, conn: CctlConnection, client_id: str, payload: dict
+        self, conn: CctlConnection, client_id: str, frame: str | bytes, request_id: str, send_slots: asyncio.Semaphore,
     ) -> tuple[dict, bool]:
         """
-        Send to a single connection and wait for response.
-        Returns (result_dict, is_dead) - is_dead=True means connection should be unregistered.
+        Send a pre-encoded frame to a single connection and wait for response.
+        Returns (result_dict, is_dead) - is_dead=True means connection should be dropped.
         """
+        if conn.multiplexed:
+            return await self._request(conn, client_id, frame, request_id, send_slots)
+        async with conn.lock:
+            return await self._request(conn, client_id, frame, request_id, send_slots)
+
+    async def _request(
+        self, conn: CctlConnection, client_id: str, frame: str | bytes, request_id: str, send_slots: asyncio.Semaphore,
+    ) -> tuple[dict, bool]:
         future: asyncio.Future = asyncio.get_running_loop().create_future()
-        conn.pending_response = future
+        conn.pending[request_id] = future
         try:
-            await conn.websocket.send_json(payload)
-            try:
-                response = await asyncio.wait_for(future, timeout=CCTL_RESPONSE_TIMEOUT)
-                if not isinstance(response, dict):
-                    log.warning("cctl %s: invalid response format (expected dict), got %s", client_id, type(response).__name__)
-                    return (
-                        {"client_id": client_id, "ok": False, "response": None, "error": "invalid response format"},
-                        False,
-                    )
-                if "error" in response:
-                    return (
-                        {"client_id": client_id, "ok": False, "response": response, "error": response["error"]},
-                        False,
-                    )
-                return (
-                    {"client_id": client_id, "ok": True, "response": response, "error": None},
-                    False,
-                )
-            except asyncio.TimeoutError:
-                return ({"client_id": client_id, "ok": False, "response": None, "error": "timeout"}, False)
+            return await self._await_response(conn, client_id, frame, future, send_slots)
+        finally:
+            conn.pending.pop(request_id, None)
+
+    async def _await_response(
+        self,
+        conn: CctlConnection,
+        client_id: str,
+        frame: str | bytes,
+        future: asyncio.Future,
+        send_slots: asyncio.Semaphore,
+    ) -> tuple[dict, bool]:
+        try:
+            # Only sending is bounded, waiting for responses costs nothing
+            async with send_slots:
+                await asyncio.wait_for(conn.send_frame(frame), timeout=CCTL_SEND_TIMEOUT)
         except Exception as e:
-            log.warning("Failed to send to cctl %s: %s", client_id, e)
-            return ({"client_id": client_id, "ok": False, "response": None, "error": str(e)}, True)
+            log.warning("Failed to send to cctl %s: %s", client_id, e or type(e).__name__)
+            return self._result(client_id, False, None, str(e) or "send timeout"), True
+        try:
+            response = await asyncio.wait_for(future, timeout=CCTL_RESPONSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return self._result(client_id, False, None, "timeout"), False
+        except Exception as e:
+            return self._result(client_id, False, None, str(e)), True
+        if not isinstance(response, dict):
+            log.warning("cctl %s: invalid response format (expected dict), got %s", client_id, type(response).__name__)
+            return self._result(client_id, False, None, "invalid response format"), False
+        if "error" in response:
+            self.set_error(client_id, str(response["error"]))
+            return self._result(client_id, False, response, response["error"]), False
+        self.update_state(client_id, response)
+        return self._result(client_id, True, response, None), False
+
+    async def fan_out(self, targets: list[tuple[str, CctlConnection]], payload: dict) -> AsyncIterator[dict]:
+        """
+        Send payload to the given (client_id, connection) pairs, yielding results as they arrive.
+        The payload is encoded once per codec and protocol version, all connections share one request id.
+        """
+        request_id = uuid.uuid4().hex
+        frames: dict[tuple[str, bool], str | bytes] = {}
+
+        def frame_for(conn: CctlConnection) -> str | bytes:
+            key = (conn.codec.name, conn.multiplexed)
+            if key not in frames:
+                frames[key] = conn.codec.encode({**payload, "request_id": request_id} if conn.multiplexed else payload)
+            return frames[key]
+        send_slots = asyncio.Semaphore(CCTL_SEND_CONCURRENCY)
+
+        async def send(client_id: str, conn: CctlConnection) -> tuple[dict, bool, str, CctlConnection]:
+            result, is_dead = await self._send_to_connection(
+                conn, client_id, frame_for(conn), request_id, send_slots,
+            )
+            return result, is_dead, client_id, conn
+
+        tasks = [asyncio.create_task(send(client_id, conn)) for client_id, conn in targets]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result, is_dead, client_id, conn = await next_done
+                if is_dead:
+                    # A timed out send may have left a partial frame on the socket, it can't be used anymore
+                    self.drop(client_id, conn)
+                yield result
         finally:
-            conn.pending_response = None
+            for task in tasks:
+                task.cancel()
+
+    def live_connections(self, client_id: str | None = None) -> list[tuple[str, CctlConnection]]:
+        """Live connections of the client, or of all clients"""
+        client_ids = list(self._connections.keys()) if client_id is None else [client_id]
+        return [
+            (cid, conn)
+            for cid in client_ids if cid in self._connections
+            for conn in list(self._connections[cid]) if conn.is_alive()
+        ]
+
+    def liveness(self) -> list[dict]:
+        """
+        Liveness of all connected sockets:
+        [{"client_id": str, "protocol": int, "connected_at": float, "idle": float, "alive": bool}]
+        """
+        return [
+            {
+                "client_id": client_id,
+                "protocol": conn.protocol,
+                "connected_at": conn.connected_at,
+                "idle": conn.idle_time(),
+                "alive": conn.is_alive(),
+            }
+            for client_id in sorted(self._connections.keys())
+            for conn in self._connections[client_id]
+        ]
+
+    async def send_to_id_iter(self, client_id: str, payload: dict) -> AsyncIterator[dict]:
+        """Send payload to all sockets with given id, yielding results as each one answers."""
+        async for result in self.fan_out(self.live_connections(client_id), payload):
+            yield result
 
     async def send_to_id(self, client_id: str, payload: dict) -> list[dict]:
         """
         Send payload to all sockets with given id, wait for responses concurrently (10s timeout).
         Returns list of results: [{"client_id": str, "ok": bool, "response": dict | None, "error": str | None}]
         """
-        if client_id not in self._connections:
-            return []
-        conns = list(self._connections[client_id])
-        results_and_dead = await asyncio.gather(
-            *[self._send_to_connection(conn, client_id, payload) for conn in conns]
-        )
-        results = [r for r, _ in results_and_dead]
-        for (_, is_dead), conn in zip(results_and_dead, conns):
-            if is_dead:
-                self.unregister(client_id, conn)
-        return results
+        return [result async for result in self.send_to_id_iter(client_id, payload)]
+
+    async def broadcast_iter(self, payload: dict) -> AsyncIterator[dict]:
+        """Send payload to all connected cctl sockets, yielding results as each one answers."""
+        async for result in self.fan_out(self.live_connections(), payload):
+            yield result
 
     async def broadcast(self, payload: dict) -> list[dict]:
         """Send payload to all connected cctl sockets concurrently, wait for responses (no stacking)."""
-        tasks = []
-        conn_map: list[tuple[CctlConnection, str]] = []
-        for client_id in list(self._connections.keys()):
-            for conn in list(self._connections[client_id]):
-                tasks.append(self._send_to_connection(conn, client_id, payload))
-                conn_map.append((conn, client_id))
-        results_and_dead = await asyncio.gather(*tasks)
-        results = [r for r, _ in results_and_dead]
-        for (_, is_dead), (conn, client_id) in zip(results_and_dead, conn_map):
-            if is_dead:
-                self.unregister(client_id, conn)
-        return results
+        return [result async for result in self.broadcast_iter(payload)]
 
 
 cctl_manager = CctlConnectionManager()
@@ -156,27 +354,48 @@ async def api_root():
     return {"status": "ok", "api": "bot_api"}
 
 
+def compute_status_token() -> str:
+    """Token for the status endpoint. HMAC in its own namespace, so it can't be used as a cctl client hash"""
+    if not _CCTL_SECRET:
+        raise RuntimeError("Bot API not configured: call configure(api_secret=...) before use")
+    return hmac.new(_CCTL_SECRET.encode(), b"status:cctl", hashlib.sha256).hexdigest()
+
+
+@app.get("/bot_api/cctl_status/{token}")
+async def cctl_status(token: str):  # compute_status_token()
+    """Fleet status from the cctl state cache, doesn't contact the clients."""
+    if not hmac.compare_digest(token, compute_status_token()):
+        raise HTTPException(status_code=403, detail="Invalid token")
+    return {"clients": cctl_manager.fleet_status()}
+
+
 async def _receive_loop(connection: CctlConnection) -> None:
-    """Receive messages from client and deliver to pending response waiter. Never exits except on disconnect."""
+    """Receive messages from client and deliver to pending response waiters. Never exits except on disconnect."""
     while True:
         try:
-            data = await connection.websocket.receive_json()
+            data = await connection.receive()
         except WebSocketDisconnect:
             break
         except Exception as e:
             log.warning("cctl %s: invalid message format (expected JSON): %s", connection.client_id, e)
-            if connection.pending_response and not connection.pending_response.done():
-                connection.pending_response.set_result({"error": "invalid message format"})
-                connection.pending_response = None
+            # Can only be attributed to a request if exactly one is in flight
+            connection.deliver_response({"error": "invalid message format"})
+            continue
+        connection.touch()
+        if isinstance(data, dict) and data.get("type") == CCTL_PONG_TYPE:
+            continue
+        if isinstance(data, dict) and data.get("type") == CCTL_STATE_TYPE:
+            # Unsolicited state report: {"type": "state", ...state fields}
+            cctl_manager.update_state(connection.client_id, {k: v for k, v in data.items() if k != "type"})
             continue
         try:
             if not isinstance(data, dict):
                 log.warning("cctl %s: invalid message type (expected dict), got %s", connection.client_id, type(data).__name__)
                 data = {"error": "invalid message format"}
-            had_waiter = connection.pending_response is not None
-            connection.deliver_response(data)
+            delivered = connection.deliver_response(data)
             # Unsolicited error: no one was waiting, but we got {"error": "..."}
-            if not had_waiter and "error" in data:
+            if not delivered and "error" in data:
+                cctl_manager.set_error(connection.client_id, str(data["error"]))
                 cb = cctl_manager._on_unsolicited_error
                 if cb:
                     try:
@@ -185,12 +404,29 @@ async def _receive_loop(connection: CctlConnection) -> None:
                         log.warning("cctl unsolicited_error callback failed for %s: %s", connection.client_id, e)
         except Exception as e:
             log.warning("cctl %s: error handling message: %s", connection.client_id, e)
-            if connection.pending_response and not connection.pending_response.done():
-                try:
-                    connection.pending_response.set_result({"error": str(e)})
-                except Exception:
-                    connection.pending_response.set_exception(e)
-                connection.pending_response = None
+
+
+async def _heartbeat_loop(connection: CctlConnection) -> None:
+    """Ping an idle protocol 2 client, drop it when it stops answering"""
+    while True:
+        idle = connection.idle_time()
+        if idle < CCTL_HEARTBEAT_INTERVAL:
+            await asyncio.sleep(CCTL_HEARTBEAT_INTERVAL - idle)
+            continue
+        if not connection.is_alive():
+            log.warning(
+                "cctl %s: missed %s heartbeats, dropping connection", connection.client_id, CCTL_HEARTBEAT_MISSED,
+            )
+            cctl_manager.drop(connection.client_id, connection)
+            return
+        try:
+            ping = connection.codec.encode({"type": CCTL_PING_TYPE})
+            await asyncio.wait_for(connection.send_frame(ping), timeout=CCTL_SEND_TIMEOUT)
+        except Exception as e:
+            log.warning("cctl %s: failed to send heartbeat: %s", connection.client_id, e or type(e).__name__)
+            cctl_manager.drop(connection.client_id, connection)
+            return
+        await asyncio.sleep(CCTL_HEARTBEAT_INTERVAL)
 
 
 @app.websocket("/bot_api/cctl/{hash}/{id}")
@@ -198,32 +434,59 @@ async def cctl_websocket(
     websocket: WebSocket,
     hash: str,  # sha1(secret + id)
     id: str,
+    protocol: int = CCTL_PROTOCOL_LEGACY,
+    codec: str | None = None,
 ):
+    """
+    Codec is negotiated with the codec query parameter, or a kotiki.cctl.<codec> subprotocol.
+    Without either frames are JSON text.
+    """
     expected = _compute_expected_hash(id)
     if hash != expected:
         log.warning("Invalid hash for cctl connection, id=%s", id)
         await websocket.close(code=4001, reason="Invalid hash")
         return
 
-    await websocket.accept()
-    connection = CctlConnection(websocket=websocket, client_id=id)
+    subprotocol = None
+    if codec is not None:
+        try:
+            frame_codec = get_codec(codec)
+        except UnsupportedCodecException as e:
+            log.warning("cctl %s: %s", id, e)
+            await websocket.close(code=4002, reason="Unsupported codec")
+            return
+    elif negotiated := negotiate_subprotocol(websocket.scope.get("subprotocols", [])):
+        subprotocol, frame_codec = negotiated
+    else:
+        frame_codec = JSON_CODEC
+
+    await websocket.accept(subprotocol=subprotocol)
+    connection = CctlConnection(websocket=websocket, client_id=id, protocol=protocol, codec=frame_codec)
     cctl_manager.register(id, connection)
-    log.info("cctl WebSocket connected: id=%s", id)
+    log.info("cctl WebSocket connected: id=%s protocol=%s codec=%s", id, protocol, frame_codec.name)
     recv_task = asyncio.create_task(_receive_loop(connection))
+    tasks = [recv_task, asyncio.create_task(connection.closed.wait())]
+    if connection.multiplexed:
+        tasks.append(asyncio.create_task(_heartbeat_loop(connection)))
 
     try:
-        await recv_task
+        # Ends on disconnect, or when the connection is dropped: failed sends or unanswered heartbeats
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception():
+                raise task.exception()
     except Exception as e:
         log.warning("cctl %s: websocket handler error: %s", id, e)
     finally:
         log.info("cctl WebSocket disconnected: id=%s", id)
+        cctl_manager.unregister(id, connection)
         try:
-            await websocket.close()
+            await asyncio.wait_for(websocket.close(), timeout=CCTL_SEND_TIMEOUT)
         except Exception:
             pass
-        recv_task.cancel()
-        try:
-            await recv_task
-        except asyncio.CancelledError:
-            pass
-        cctl_manager.unregister(id, connection)
+        for task in tasks:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
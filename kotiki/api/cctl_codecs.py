@@ -0,0 +1,103 @@
+import abc
+import json
+from typing import Any
+
+# Subprotocol names a client may offer, e.g. Sec-WebSocket-Protocol: kotiki.cctl.msgpack
+SUBPROTOCOL_PREFIX = "kotiki.cctl."
+
+
+class UnsupportedCodecException(Exception):
+    pass
+
+
+class CctlCodec(abc.ABC):
+    """Encoding of cctl frames. Binary codecs are sent as binary WebSocket frames, others as text frames"""
+
+    name: str
+    binary: bool = False
+
+    @abc.abstractmethod
+    def encode(self, payload: Any) -> str | bytes:
+        pass
+
+    @abc.abstractmethod
+    def decode(self, data: str | bytes) -> Any:
+        pass
+
+
+class JsonCodec(CctlCodec):
+    """Default, same encoding as WebSocket.send_json"""
+
+    name = "json"
+
+    def encode(self, payload: Any) -> str:
+        return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+    def decode(self, data: str | bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(CctlCodec):
+    """JSON text frames, encoded by orjson"""
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def encode(self, payload: Any) -> str:
+        return self._orjson.dumps(payload).decode()
+
+    def decode(self, data: str | bytes) -> Any:
+        return self._orjson.loads(data)
+
+
+class MsgpackCodec(CctlCodec):
+    """Binary frames encoded by msgpack"""
+
+    name = "msgpack"
+    binary = True
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def encode(self, payload: Any) -> bytes:
+        return self._msgpack.packb(payload)
+
+    def decode(self, data: str | bytes) -> Any:
+        if isinstance(data, str):
+            data = data.encode()
+        return self._msgpack.unpackb(data)
+
+
+JSON_CODEC = JsonCodec()
+_CODEC_TYPES: dict[str, type[CctlCodec]] = {
+    codec_type.name: codec_type for codec_type in (JsonCodec, OrjsonCodec, MsgpackCodec)
+}
+_codecs: dict[str, CctlCodec] = {JSON_CODEC.name: JSON_CODEC}
+
+
+def get_codec(name: str) -> CctlCodec:
+    """Codec by name. Raises UnsupportedCodecException if unknown or its optional dependency is not installed"""
+    if name not in _codecs:
+        if name not in _CODEC_TYPES:
+            raise UnsupportedCodecException("Unknown codec {}".format(name))
+        try:
+            _codecs[name] = _CODEC_TYPES[name]()
+        except ImportError as e:
+            raise UnsupportedCodecException("Codec {} not available: {}".format(name, e))
+    return _codecs[name]
+
+
+def negotiate_subprotocol(subprotocols: list[str]) -> tuple[str, CctlCodec] | None:
+    """First offered cctl subprotocol with an available codec"""
+    for subprotocol in subprotocols:
+        if not subprotocol.startswith(SUBPROTOCOL_PREFIX):
+            continue
+        try:
+            return subprotocol, get_codec(subprotocol[len(SUBPROTOCOL_PREFIX):])
+        except UnsupportedCodecException:
+            continue
+    return None
@@ -1,25 +1,83 @@
+import asyncio
 import logging
 import re
+import time
 
 from aiogram import Dispatcher, html, Bot
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.types import Message
 
 from kotiki.api.bot_api import cctl_manager
-from kotiki.core.api_client import FastAPIClient
+from kotiki.core.api_client import CachingAPIClient, FastAPIClient
 from kotiki.core.models.config import Config
 
 log = logging.getLogger(__name__)
 
-# cctl command patterns: c{number}, ca, c{number}s, cas
+# cctl command patterns: c{number}, ca, c{number}s, cas, cl (list connections), cst (fleet status)
 _CCTL_START_ONE = re.compile(r"^c(\d+)$")
 _CCTL_STOP_ONE = re.compile(r"^c(\d+)s$")
+# Progress edits of a cctl reply are throttled to stay within Telegram limits
+_CCTL_EDIT_INTERVAL = 1.0
 
 
-def _format_cctl_results(results: list[dict], action: str, *, client_id: str | None = None) -> str:
-    """Format cctl command results for chat. If client_id given and no results, show specific message."""
-    if not results:
+_ALL_SENSORS = "all"
+_SENSOR_LIST_ENDPOINT = "/sensors"
+_MAX_MESSAGE_LENGTH = 4096
+
+
+def _parse_sensor_list(data: list | dict) -> list[str]:
+    """Sensor names from the sensor list endpoint: a list of names or of {"name": ...}, possibly under "sensors" key"""
+    if isinstance(data, dict):
+        data = data["sensors"]
+    return [item["name"] if isinstance(item, dict) else str(item) for item in data]
+
+
+def _split_section(section: str, max_length: int) -> list[str]:
+    """Split a section longer than max_length at line breaks, and lines longer than that anywhere"""
+    if len(section) <= max_length:
+        return [section]
+    parts = []
+    current = ""
+    for line in section.split("\n"):
+        while len(line) > max_length:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:max_length])
+            line = line[max_length:]
+        if current and len(current) + 1 + len(line) > max_length:
+            parts.append(current)
+            current = ""
+        current = current + "\n" + line if current else line
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _join_sections(sections: list[str], separator: str, max_length: int) -> list[str]:
+    """Join sections into as few messages as fit the message length limit, splitting oversized sections"""
+    messages = []
+    current = ""
+    for section in (part for section in sections for part in _split_section(section, max_length)):
+        if current and len(current) + len(separator) + len(section) > max_length:
+            messages.append(current)
+            current = ""
+        current = current + separator + section if current else section
+    if current:
+        messages.append(current)
+    return messages
+
+
+def _format_cctl_results(
+    results: list[dict], action: str, *, client_id: str | None = None, total: int | None = None,
+) -> str:
+    """
+    Format cctl command results for chat. If client_id given and no results, show specific message.
+    If total given, results may be partial: show how many sockets are still awaited, or a summary when complete.
+    """
+    if not results and total is None:
         if client_id is not None:
             return f"No cctl socket with id {client_id} connected"
         return "No cctl sockets connected"
@@ -32,11 +90,78 @@ def _format_cctl_results(results: list[dict], action: str, *, client_id: str | N
             lines.append(f"  cctl {cid}: {r['error']}")
         else:
             lines.append(f"  cctl {cid}: unknown result {r}")
+    if total is not None:
+        if len(results) < total:
+            lines.append(f"  waiting for {total - len(results)} more...")
+        else:
+            ok = sum(1 for r in results if r["ok"])
+            lines.append(f"Done: {ok} ok, {total - ok} failed")
     return f"{action}:\n" + "\n".join(lines)
 
 
+def _format_cctl_liveness(liveness: list[dict]) -> str:
+    if not liveness:
+        return "No cctl sockets connected"
+    lines = []
+    for c in liveness:
+        state = "alive" if c["alive"] else "not responding"
+        lines.append(f"  cctl {c['client_id']}: {state}, last seen {c['idle']:.0f}s ago")
+    return "cctl connections:\n" + "\n".join(lines)
+
+
+def _format_age(timestamp: float | None) -> str:
+    if timestamp is None:
+        return "never"
+    return f"{time.time() - timestamp:.0f}s ago"
+
+
+def _format_cctl_fleet_status(fleet: list[dict]) -> str:
+    if not fleet:
+        return "No cctl clients known"
+    lines = []
+    for c in fleet:
+        if c["alive"]:
+            connection = "online"
+        elif c["connections"]:
+            connection = "not responding"
+        else:
+            connection = "offline"
+        lines.append(f"  cctl {c['client_id']}: {connection}")
+        if c["state"] is not None:
+            state = ", ".join(f"{k}={v}" for k, v in c["state"].items()) or "empty"
+            lines.append(f"    state: {state} ({_format_age(c['state_updated_at'])})")
+        if c["last_error"] is not None:
+            lines.append(f"    last error: {c['last_error']} ({_format_age(c['last_error_at'])})")
+    return "cctl fleet status:\n" + "\n".join(lines)
+
+
+class _EditableReply:
+    """Sent reply edited in place. Skips edits that don't change the text, Telegram rejects them"""
+
+    MAX_FLOOD_RETRIES = 3
+
+    def __init__(self, message: Message, text: str):
+        self.message = message
+        self.text = text
+
+    async def edit(self, text: str):
+        if text == self.text:
+            return
+        for _ in range(self.MAX_FLOOD_RETRIES + 1):
+            try:
+                await self.message.edit_text(text)
+                self.text = text
+                return
+            except TelegramRetryAfter as e:
+                log.warning("Flood control editing reply, retrying in {}s".format(e.retry_after))
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                log.warning("Failed to edit reply: {}".format(e))
+                return
+
+
 class BotCommands:
-    def __init__(self, config: Config, sensors_api: FastAPIClient):
+    def __init__(self, config: Config, sensors_api: FastAPIClient | CachingAPIClient):
         self.config = config
         self.sensors_api = sensors_api
         self.dp = Dispatcher()
@@ -62,42 +187,93 @@ class BotCommands:
         log.info("Command '{}' for {} '{}'".format(
             message.text, message.chat.id, message.from_user.username,
         ))
-        if command.args is None or " " in command.args:
-            await message.answer("Wrong command: only one argument <sensor_name> supported")
+        names = command.args.split() if command.args else []
+        if not names:
+            await message.answer("Wrong command: /sensor <sensor_name> [<sensor_name> ...] or /sensor all")
             return
+        if names == [_ALL_SENSORS]:
+            try:
+                names = _parse_sensor_list(await self.sensors_api.get(_SENSOR_LIST_ENDPOINT))
+            except Exception as e:
+                log.exception("Getting sensor list from sensors API")
+                await message.answer(html.bold(html.quote("Error: {}".format(e))), parse_mode=ParseMode.HTML)
+                return
+            if not names:
+                await message.answer("No sensors")
+                return
+        names = list(dict.fromkeys(names))
+        results = await asyncio.gather(
+            *[self.sensors_api.get("/sensors/{}".format(name)) for name in names], return_exceptions=True,
+        )
+        sections = []
+        for name, data in zip(names, results):
+            if isinstance(data, Exception):
+                log.error("Getting sensor {} data from sensors API: {}".format(name, data))
+                sections.append("Sensor {}: {}".format(
+                    html.quote(name), html.bold(html.quote("Error: {}".format(data))),
+                ))
+                continue
+            response = [
+                "  {}: {}".format(html.quote(str(key)), html.bold(html.quote(str(value))))
+                for key, value in data["measurements"].items()
+            ]
+            sections.append("Sensor {} readings:\n\n{}".format(html.quote(name), "\n".join(response)))
+        for text in _join_sections(sections, "\n\n", _MAX_MESSAGE_LENGTH):
+            await message.answer(text, parse_mode=ParseMode.HTML)
+
+    async def _cctl_command(self, message: Message, payload: dict, action: str, *, client_id: str | None = None):
+        """Send a cctl command, reply at once and edit the reply as sockets answer"""
+        targets = cctl_manager.live_connections(client_id)
+        if not targets:
+            await message.answer(_format_cctl_results([], action, client_id=client_id))
+            return
+        total = len(targets)
+        results: list[dict] = []
+        text = _format_cctl_results(results, action, total=total)
+        reply = _EditableReply(await message.answer(text), text)
+        updated = asyncio.Event()
+
+        async def refresh():
+            # At most one edit per interval, the latest results are shown even if the next socket hangs
+            while True:
+                await updated.wait()
+                updated.clear()
+                await reply.edit(_format_cctl_results(results, action, total=total))
+                await asyncio.sleep(_CCTL_EDIT_INTERVAL)
+
+        refresher = asyncio.create_task(refresh())
         try:
-            data = await self.sensors_api.get("/sensors/{}".format(command.args))
-        except Exception as e:
-            log.exception("Getting data from sensors API")
-            await message.answer(html.bold("Error: {}".format(e)), parse_mode=ParseMode.HTML)
-        else:
-            response = ["  {}: {}".format(name, html.bold(value)) for name, value in data["measurements"].items()]
-            await message.answer(
-                "Sensor {} readings:\n\n{}".format(command.args, "\n".join(response)), parse_mode=ParseMode.HTML,
-            )
+            async for result in cctl_manager.fan_out(targets, payload):
+                results.append(result)
+                updated.set()
+        finally:
+            refresher.cancel()
+        await reply.edit(_format_cctl_results(results, action, total=total))
 
     async def message_handler(self, message: Message):
         log.info("Message {} from {} '{}'".format(message.text, message.chat.id, message.from_user.username))
 
         text = message.text.strip().lower()
         if self.config.is_known(str(message.chat.id)):
+            if text == "cl":
+                await message.answer(_format_cctl_liveness(cctl_manager.liveness()))
+                return
+            if text == "cst":
+                await message.answer(_format_cctl_fleet_status(cctl_manager.fleet_status()))
+                return
             if text == "cas":
-                results = await cctl_manager.broadcast({"start": False})
-                await message.answer(_format_cctl_results(results, "Stop"))
+                await self._cctl_command(message, {"start": False}, "Stop")
                 return
             if text == "ca":
-                results = await cctl_manager.broadcast({"start": True})
-                await message.answer(_format_cctl_results(results, "Start"))
+                await self._cctl_command(message, {"start": True}, "Start")
                 return
             if m := _CCTL_STOP_ONE.match(text):
                 client_id = m.group(1)
-                results = await cctl_manager.send_to_id(client_id, {"start": False})
-                await message.answer(_format_cctl_results(results, f"Stop cctl {client_id}", client_id=client_id))
+                await self._cctl_command(message, {"start": False}, f"Stop cctl {client_id}", client_id=client_id)
                 return
             if m := _CCTL_START_ONE.match(text):
                 client_id = m.group(1)
-                results = await cctl_manager.send_to_id(client_id, {"start": True})
-                await message.answer(_format_cctl_results(results, f"Start cctl {client_id}", client_id=client_id))
+                await self._cctl_command(message, {"start": True}, f"Start cctl {client_id}", client_id=client_id)
                 return
 
         for alias in self.config.aliases:
@@ -1,12 +1,26 @@
-from typing import Optional, Dict, Any
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Hashable
 
 import aiohttp
 
+from kotiki.core.models.config import SensorsCacheConfig
+
+log = logging.getLogger(__name__)
+
 
 class FastAPIClient:
-    def __init__(self, base_url: str):
+    def __init__(
+        self, base_url: str, timeout: float = 10.0, max_connections: int = 10, keepalive_timeout: float = 60.0,
+    ):
         self.base_url = base_url
-        self.session = aiohttp.ClientSession()
+        # One long lived session: connections to the API are kept alive and reused by concurrent requests
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            connector=aiohttp.TCPConnector(limit_per_host=max_connections, keepalive_timeout=keepalive_timeout),
+        )
 
     async def __aenter__(self):
         return self
@@ -22,3 +36,105 @@ class FastAPIClient:
         async with self.session.get(url, params=params) as resp:
             resp.raise_for_status()
             return await resp.json()
+
+
+@dataclass
+class _CacheEntry:
+    data: Dict[str, Any]
+    # Monotonic time
+    fetched_at: float
+
+
+class CachingAPIClient:
+    """
+    Caches GET responses of a FastAPIClient with per endpoint TTLs in a bounded LRU.
+    Concurrent identical requests share one upstream call. Optionally answers with stale data while refreshing it.
+    """
+
+    def __init__(self, client: FastAPIClient, config: SensorsCacheConfig):
+        self.client = client
+        self._config = config
+        self._entries: OrderedDict[Hashable, _CacheEntry] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self._background: set[asyncio.Task] = set()
+        # Longest prefixes first
+        self._ttls = sorted(
+            ((prefix, ttl.total_seconds()) for prefix, ttl in config.endpoint_ttls.items()),
+            key=lambda item: len(item[0]), reverse=True,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        for task in self._background:
+            task.cancel()
+        await self.client.close()
+
+    def _ttl(self, endpoint: str) -> float:
+        for prefix, ttl in self._ttls:
+            if endpoint.startswith(prefix):
+                return ttl
+        return self._config.ttl.total_seconds()
+
+    @staticmethod
+    def _key(endpoint: str, params: Optional[Dict[str, Any]]) -> Hashable:
+        return endpoint, tuple(sorted((params or {}).items()))
+
+    def _store(self, key: Hashable, data: Dict[str, Any]):
+        self._entries[key] = _CacheEntry(data=data, fetched_at=asyncio.get_running_loop().time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._config.max_size:
+            self._entries.popitem(last=False)
+
+    async def _load(self, key: Hashable, endpoint: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        try:
+            data = await self.client.get(endpoint, params=params)
+            self._store(key, data)
+            return data
+        finally:
+            del self._inflight[key]
+
+    async def _fetch(self, key: Hashable, endpoint: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Single-flight upstream request: callers of a key in flight wait for the same task.
+        The task is shielded, so one cancelled caller doesn't fail the others.
+        """
+        if key not in self._inflight:
+            self._inflight[key] = asyncio.create_task(self._load(key, endpoint, params))
+        return await asyncio.shield(self._inflight[key])
+
+    def _revalidate(self, key: Hashable, endpoint: str, params: Optional[Dict[str, Any]]):
+        if key in self._inflight:
+            return
+
+        async def revalidate():
+            try:
+                await self._fetch(key, endpoint, params)
+            except Exception as e:
+                log.warning("Failed to revalidate {}: {}".format(endpoint, e))
+
+        task = asyncio.create_task(revalidate())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def get(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if not self._config.enabled:
+            return await self.client.get(endpoint, params=params)
+        key = self._key(endpoint, params)
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = asyncio.get_running_loop().time() - entry.fetched_at
+            ttl = self._ttl(endpoint)
+            if age < ttl:
+                self._entries.move_to_end(key)
+                return entry.data
+            swr = self._config.stale_while_revalidate
+            if swr is not None and age < ttl + swr.total_seconds():
+                self._entries.move_to_end(key)
+                self._revalidate(key, endpoint, params)
+                return entry.data
+        return await self._fetch(key, endpoint, params)
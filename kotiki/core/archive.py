@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class ArchiveEntry:
+    time: datetime
+    target: str
+    url: str
+    hash: str
+    size: int
+
+
+class PageArchive:
+    """
+    Content-addressed archive of page bodies. Bodies are stored gzip-compressed once per sha256 under
+    objects/, every stored event is appended to index.jsonl. Methods are blocking, call them in a thread.
+    """
+
+    INDEX_FILE = "index.jsonl"
+    OBJECTS_DIR = "objects"
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._lock = threading.Lock()
+
+    @property
+    def _index_path(self) -> Path:
+        return self.root / self.INDEX_FILE
+
+    def _object_path(self, digest: str) -> Path:
+        return self.root / self.OBJECTS_DIR / digest[:2] / "{}.gz".format(digest[2:])
+
+    def store(self, target: str, url: str, body: bytes, time: Optional[datetime] = None) -> str:
+        """Store the body and add an index entry. Returns the content hash"""
+        digest = hashlib.sha256(body).hexdigest()
+        entry = ArchiveEntry(
+            time=time or datetime.now(), target=target, url=url, hash=digest, size=len(body),
+        )
+        path = self._object_path(digest)
+        with self._lock:
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(path.name + ".tmp")
+                with gzip.open(tmp_path, "wb") as f:
+                    f.write(body)
+                os.replace(tmp_path, path)
+            with open(self._index_path, "a", encoding="utf-8") as f:
+                f.write(self._dump_entry(entry) + "\n")
+        return digest
+
+    @staticmethod
+    def _dump_entry(entry: ArchiveEntry) -> str:
+        data = asdict(entry)
+        data["time"] = entry.time.isoformat()
+        return json.dumps(data, ensure_ascii=False)
+
+    @staticmethod
+    def _load_entry(line: str) -> ArchiveEntry:
+        data = json.loads(line)
+        data["time"] = datetime.fromisoformat(data["time"])
+        return ArchiveEntry(**data)
+
+    def entries(self, target: Optional[str] = None, url: Optional[str] = None) -> list[ArchiveEntry]:
+        """Index entries, oldest first, optionally filtered by target and url"""
+        if not self._index_path.exists():
+            return []
+        result = []
+        with open(self._index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = self._load_entry(line)
+                except Exception:
+                    log.warning("Skipping broken archive index line in {}: {!r}".format(self.root, line))
+                    continue
+                if (target is None or entry.target == target) and (url is None or entry.url == url):
+                    result.append(entry)
+        return result
+
+    def read(self, digest: str) -> bytes:
+        with gzip.open(self._object_path(digest), "rb") as f:
+            return f.read()
+
+    def prune(self, max_age: Optional[timedelta] = None, max_size: Optional[int] = None) -> int:
+        """
+        Drop index entries older than max_age, then oldest entries until stored objects fit in max_size bytes.
+        Deletes objects no longer referenced. Returns number of dropped entries.
+        """
+        with self._lock:
+            entries = self.entries()
+            kept = entries
+            if max_age is not None:
+                threshold = datetime.now() - max_age
+                kept = [entry for entry in kept if entry.time >= threshold]
+
+            if max_size is not None:
+                refs = Counter(entry.hash for entry in kept)
+                sizes = {}
+                for digest in refs:
+                    path = self._object_path(digest)
+                    sizes[digest] = path.stat().st_size if path.exists() else 0
+                total = sum(sizes.values())
+                dropped = 0
+                while dropped < len(kept) and total > max_size:
+                    digest = kept[dropped].hash
+                    refs[digest] -= 1
+                    if not refs[digest]:
+                        total -= sizes[digest]
+                    dropped += 1
+                kept = kept[dropped:]
+
+            if len(kept) == len(entries):
+                return 0
+            tmp_path = self._index_path.with_name(self.INDEX_FILE + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in kept:
+                    f.write(self._dump_entry(entry) + "\n")
+            os.replace(tmp_path, self._index_path)
+
+            referenced = {entry.hash for entry in kept}
+            for entry in entries:
+                if entry.hash not in referenced:
+                    self._object_path(entry.hash).unlink(missing_ok=True)
+                    referenced.add(entry.hash)
+            return len(entries) - len(kept)
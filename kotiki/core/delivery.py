@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from kotiki.core.managers.notifications_manager import NotificationsManager
+from kotiki.core.metrics import metrics
+from kotiki.core.models.config import NotificationsConfig
+from kotiki.core.models.db import Notification
+from kotiki.core.rate_limit import TokenBucket
+
+log = logging.getLogger(__name__)
+
+
+class DeliveryEngine:
+    """
+    Sends claimed notifications concurrently across chats and in order within a chat,
+    within Telegram rate limits, then acks or fails them in the queue.
+    Consecutive notifications to a chat are merged into digest messages up to the message size limit.
+    """
+
+    DIGEST_SEPARATOR = "\n\n"
+    # Share of the lease time for sending a batch. Chats not done by then are released back to the queue,
+    # so that rows are never re-claimed by another consumer while still being sent.
+    LEASE_SAFETY = 0.5
+
+    def __init__(self, config: NotificationsConfig, bot: Bot, manager: NotificationsManager):
+        self._config = config
+        self._bot = bot
+        self._manager = manager
+        self._global_bucket = TokenBucket(rate=config.global_rate, capacity=config.global_rate)
+        self._chat_buckets: dict[str, TokenBucket] = {}
+        self._concurrency = asyncio.Semaphore(config.concurrency)
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        if chat_id not in self._chat_buckets:
+            # Negative ids are groups and channels, they have a stricter limit
+            rate = self._config.group_chat_rate if chat_id.startswith("-") else self._config.chat_rate
+            self._chat_buckets[chat_id] = TokenBucket(rate=rate, capacity=max(rate, 1.0))
+        return self._chat_buckets[chat_id]
+
+    @staticmethod
+    def _format(notification: Notification) -> str:
+        if notification.duplicates:
+            return "{} (repeated {} more times)".format(notification.message, notification.duplicates)
+        return notification.message
+
+    @staticmethod
+    def _message_length(text: str) -> int:
+        """Length as Telegram counts it, in UTF-16 code units"""
+        return len(text.encode("utf-16-le")) // 2
+
+    def _make_digests(self, notifications: list[Notification]) -> list[list[Notification]]:
+        """Split a chat's notifications, in order, into groups fitting one message each"""
+        if not self._config.digest:
+            return [[notification] for notification in notifications]
+        separator_length = self._message_length(self.DIGEST_SEPARATOR)
+        digests = []
+        current: list[Notification] = []
+        length = 0
+        for notification in notifications:
+            added = self._message_length(self._format(notification)) + (separator_length if current else 0)
+            if current and length + added > self._config.max_message_length:
+                digests.append(current)
+                current, length = [], 0
+                added = self._message_length(self._format(notification))
+            current.append(notification)
+            length += added
+        if current:
+            digests.append(current)
+        return digests
+
+    async def _send(self, chat_id: str, text: str, deadline: float):
+        loop = asyncio.get_running_loop()
+        chat_bucket = self._chat_bucket(chat_id)
+        for retry in range(self._config.max_flood_retries + 1):
+            await chat_bucket.acquire()
+            await self._global_bucket.acquire()
+            # Only the request itself takes a concurrency slot, rate limit waits and flood pauses don't
+            async with self._concurrency:
+                started = loop.time()
+                try:
+                    await self._bot.send_message(chat_id, text)
+                    metrics.observe("notifications.send_time", loop.time() - started)
+                    return
+                except TelegramRetryAfter as e:
+                    retry_after = e.retry_after
+                    if retry == self._config.max_flood_retries or loop.time() + retry_after > deadline:
+                        raise
+            log.warning("Flood control for chat {}, pausing it for {}s".format(chat_id, retry_after))
+            # Only this chat waits, other chats keep going
+            chat_bucket.pause(retry_after)
+
+    @staticmethod
+    def _observe_delivered(notifications: list[Notification]):
+        now = datetime.now()
+        for notification in notifications:
+            if notification.created_at is None:
+                continue
+            if notification.first_attempt_at is not None:
+                queue_wait = notification.first_attempt_at - notification.created_at
+                metrics.observe("notifications.queue_wait", queue_wait.total_seconds())
+            metrics.observe("notifications.delivery_latency", (now - notification.created_at).total_seconds())
+            metrics.observe("notifications.attempts", notification.attempts + 1)
+
+    async def _send_chat(
+        self,
+        notifications: list[Notification],
+        deadline: float,
+        sent: list[Notification],
+        failed: list[Notification],
+        released: list[Notification],
+    ):
+        loop = asyncio.get_running_loop()
+        digests = self._make_digests(notifications)
+        for i, digest in enumerate(digests):
+            if loop.time() >= deadline:
+                log.info("Lease time is running out, releasing {} notifications for chat {}".format(
+                    sum(len(rest) for rest in digests[i:]), digest[0].chat_id,
+                ))
+                released.extend(n for rest in digests[i:] for n in rest)
+                return
+            log.debug(f"Executing notifications: {digest}")
+            text = self.DIGEST_SEPARATOR.join(self._format(notification) for notification in digest)
+            try:
+                await self._send(digest[0].chat_id, text, deadline)
+            except Exception:
+                log.exception(f"Exception sending notifications: {digest}")
+                failed.extend(digest)
+                # Later digests weren't attempted, they go back to the queue and are not claimed
+                # until the failed one is due again, so that the chat gets them in order
+                released.extend(n for rest in digests[i + 1:] for n in rest)
+                return
+            else:
+                sent.extend(digest)
+                self._observe_delivered(digest)
+
+    async def deliver(self, batch: list[Notification]):
+        """Deliver a freshly claimed batch within its lease time"""
+        deadline = asyncio.get_running_loop().time() + self._config.lease_time.total_seconds() * self.LEASE_SAFETY
+        by_chat: dict[str, list[Notification]] = defaultdict(list)
+        for notification in batch:
+            by_chat[notification.chat_id].append(notification)
+
+        sent: list[Notification] = []
+        failed: list[Notification] = []
+        released: list[Notification] = []
+        async with asyncio.TaskGroup() as task_group:
+            for notifications in by_chat.values():
+                task_group.create_task(self._send_chat(notifications, deadline, sent, failed, released))
+
+        dropped = [n for n in failed if n.attempts + 1 >= self._config.max_attempts]
+        for notification in dropped:
+            log.error(f"Dropping notification after {notification.attempts + 1} attempts: {notification}")
+        await self._manager.ack(sent + dropped)
+        await self._manager.fail(
+            [n for n in failed if n not in dropped], retry_delay=self._config.retry_delay,
+        )
+        await self._manager.release(released)
@@ -0,0 +1,52 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+
+@dataclass
+class _HostState:
+    semaphore: asyncio.Semaphore
+    next_start: float = 0.0
+
+
+class HostLimiter:
+    """
+    Limits concurrent requests globally and per host, and spaces out request starts to the same host.
+    Collects time spent waiting for a slot.
+    """
+
+    def __init__(self, max_concurrency: int, per_host_concurrency: int, per_host_interval: float):
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._per_host_concurrency = per_host_concurrency
+        self._per_host_interval = per_host_interval
+        self._hosts: dict[str, _HostState] = {}
+        self._wait_times: list[float] = []
+
+    def _host_state(self, host: str) -> _HostState:
+        if host not in self._hosts:
+            self._hosts[host] = _HostState(semaphore=asyncio.Semaphore(self._per_host_concurrency))
+        return self._hosts[host]
+
+    @asynccontextmanager
+    async def slot(self, host: str) -> AsyncIterator[float]:
+        """Wait for a request slot for the host. Yields the time waited in seconds."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        state = self._host_state(host)
+        # Host slot first, so tasks waiting for a busy host don't hold global slots
+        async with state.semaphore:
+            start_at = max(loop.time(), state.next_start)
+            state.next_start = start_at + self._per_host_interval
+            delay = start_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with self._global:
+                waited = loop.time() - started
+                self._wait_times.append(waited)
+                yield waited
+
+    def pop_wait_times(self) -> list[float]:
+        result = self._wait_times
+        self._wait_times = []
+        return result
@@ -1,13 +1,78 @@
+import hashlib
 import logging
-from typing import Optional, AsyncIterable
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Sequence
 
-from sqlalchemy import select
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
 from kotiki.core.db import DB
 from kotiki.core.models.db import Notification
 
 log = logging.getLogger(__name__)
 
+NOTIFY_CHANNEL = "kotiki_notifications"
+
+
+async def signal_new_notifications(session: AsyncSession):
+    """Wake up push consumers on commit. Only Postgres needs it, SQLite consumers watch the database file"""
+    if session.bind.dialect.name == "postgresql":
+        await session.execute(select(func.pg_notify(NOTIFY_CHANNEL, "")))
+
+
+def make_content_hash(chat_id: str, dedup_key: str) -> str:
+    return hashlib.sha256("{}\n{}".format(chat_id, dedup_key).encode()).hexdigest()
+
+
+async def insert_notifications(session: AsyncSession, notifications: Sequence[Notification]) -> list[int]:
+    """
+    Insert notifications in the session's transaction with a single upsert. A notification identical to a pending
+    one (by content_hash, from the message if not set) only increments the pending one's duplicates counter.
+    Returns ids of the resulting rows.
+    """
+    if not notifications:
+        return []
+    for notification in notifications:
+        if notification.content_hash is None:
+            notification.content_hash = make_content_hash(notification.chat_id, notification.message)
+    counts = Counter(notification.content_hash for notification in notifications)
+    unique = list({notification.content_hash: notification for notification in notifications}.values())
+
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        insert = postgresql.insert
+    elif dialect == "sqlite":
+        insert = sqlite.insert
+    else:
+        raise RuntimeError("Unsupported db dialect: {}".format(dialect))
+    # Client time like all other queue timestamps, server default may be in another timezone
+    now = datetime.now()
+    stmt = insert(Notification).values([
+        {
+            "chat_id": notification.chat_id,
+            "message": notification.message,
+            "created_at": now,
+            "next_attempt_at": now,
+            "content_hash": notification.content_hash,
+            "duplicates": counts[notification.content_hash] - 1,
+        }
+        for notification in unique
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Notification.content_hash],
+        set_={"duplicates": Notification.duplicates + stmt.excluded.duplicates + 1},
+    ).returning(Notification.id)
+    result = await session.execute(stmt)
+    ids = list(result.scalars())
+    if len(unique) < len(notifications):
+        log.debug("Collapsed {} duplicate notifications".format(len(notifications) - len(unique)))
+    await signal_new_notifications(session)
+    return ids
+
 
 class NotificationsManager:
     def __init__(self, db: DB):
@@ -16,27 +81,102 @@ class NotificationsManager:
     async def add(self, notification: Notification) -> int:
         log.debug("Adding notification {}: '{}'".format(notification.chat_id, notification.message))
         async with self.db.session() as session:
-            session.add(notification)
+            [notification_id] = await insert_notifications(session, [notification])
             await session.commit()
             log.debug("Added notification {}: '{}'. Id={}".format(
-                notification.message, notification.chat_id, notification.id,
+                notification.message, notification.chat_id, notification_id,
             ))
-            return notification.id
+            return notification_id
+
+    async def claim(self, limit: int, lease_time: timedelta) -> list[Notification]:
+        """
+        Lease up to limit due notifications, oldest first. Leased rows are not returned to other claimers
+        until acked, failed or the lease expires. Chats with a failed notification not yet due again are skipped,
+        so that a chat gets its notifications in order. Uses FOR UPDATE SKIP LOCKED where supported,
+        on SQLite the single UPDATE statement is atomic by itself.
+        """
+        now = datetime.now()
+        token = uuid.uuid4().hex
+        # Chats with a failed notification waiting for its retry, their later notifications wait too
+        retrying = aliased(Notification)
+        retrying_chats = (
+            select(retrying.chat_id)
+            .where(retrying.next_attempt_at > now)
+            .where(retrying.attempts > 0)
+        )
+        due_ids = (
+            select(Notification.id)
+            .where(Notification.next_attempt_at <= now)
+            .where(or_(Notification.leased_until.is_(None), Notification.leased_until < now))
+            .where(Notification.chat_id.not_in(retrying_chats))
+            .order_by(Notification.created_at, Notification.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        async with self.db.session() as session:
+            await session.execute(
+                update(Notification)
+                .where(Notification.id.in_(due_ids))
+                .values(
+                    lease_token=token,
+                    leased_until=now + lease_time,
+                    first_attempt_at=func.coalesce(Notification.first_attempt_at, now),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            result = await session.execute(
+                select(Notification)
+                .where(Notification.lease_token == token)
+                .order_by(Notification.created_at, Notification.id)
+            )
+            return list(result.scalars())
 
-    async def get_next(self) -> Optional[Notification]:
+    async def count_pending(self) -> int:
         async with self.db.session() as session:
-            stmt = select(Notification).order_by(Notification.created_at).limit(1)
-            result = await session.execute(stmt)
-            return result.scalar_one_or_none()
-
-    async def generate_actual(self) -> AsyncIterable[Notification]:
-        while True:
-            notification = await self.get_next()
-            if notification is None:
-                break
-            yield notification
-
-    async def delete(self, notification: Notification):
+            result = await session.execute(select(func.count(Notification.id)))
+            return result.scalar_one()
+
+    async def ack(self, notifications: Sequence[Notification]):
+        """Delete delivered notifications"""
+        if not notifications:
+            return
+        async with self.db.session() as session:
+            await session.execute(delete(Notification).where(Notification.id.in_([n.id for n in notifications])))
+            await session.commit()
+
+    async def release(self, notifications: Sequence[Notification]):
+        """Return leased notifications to the queue without counting an attempt"""
+        if not notifications:
+            return
+        async with self.db.session() as session:
+            await session.execute(
+                update(Notification)
+                .where(Notification.id.in_([n.id for n in notifications]))
+                .values(leased_until=None, lease_token=None)
+            )
+            await session.commit()
+
+    async def fail(self, notifications: Sequence[Notification], retry_delay: timedelta):
+        """Release failed notifications for another attempt after an exponential backoff from retry_delay"""
+        if not notifications:
+            return
+        now = datetime.now()
+        # The backoff depends only on the attempt number, so one update per attempt number
+        by_attempts: dict[int, list[int]] = defaultdict(list)
+        for notification in notifications:
+            notification.attempts += 1
+            by_attempts[notification.attempts].append(notification.id)
         async with self.db.session() as session:
-            await session.delete(notification)
+            for attempts, ids in by_attempts.items():
+                await session.execute(
+                    update(Notification)
+                    .where(Notification.id.in_(ids))
+                    .values(
+                        attempts=attempts,
+                        next_attempt_at=now + retry_delay * 2 ** (attempts - 1),
+                        leased_until=None,
+                        lease_token=None,
+                    )
+                )
             await session.commit()
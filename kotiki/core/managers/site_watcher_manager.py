@@ -1,10 +1,14 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Sequence
 
 import yarl
 from sqlalchemy import delete, select
 
 from kotiki.core.db import DB
-from kotiki.core.models.db import SiteWatchSuspension
+from kotiki.core.managers.notifications_manager import insert_notifications
+from kotiki.core.models.db import (
+    Notification, SiteWatchFingerprint, SiteWatchHttpCache, SiteWatchSuspension, SiteWatchUrlStats,
+)
 
 
 class SuspensionChecker:
@@ -19,6 +23,164 @@ class SuspensionChecker:
         return self._make_key(target, str(url), value, watch_type) in self._hash
 
 
+class HttpValidatorCache:
+    """In-memory view of the HTTP validator cache for one run. Changed entries are saved by the manager."""
+
+    def __init__(self, entries: list[SiteWatchHttpCache]):
+        self._entries = {entry.url: entry for entry in entries}
+        self._dirty: set[str] = set()
+
+    @staticmethod
+    def make_verdict_key(watch_type: str, value: str, selector: Optional[str] = None) -> str:
+        if selector is not None:
+            return "{}:{}:{}".format(watch_type, selector, value)
+        return "{}:{}".format(watch_type, value)
+
+    def get(self, url: yarl.URL) -> Optional[SiteWatchHttpCache]:
+        return self._entries.get(str(url))
+
+    def conditional_headers(self, url: yarl.URL, verdict_keys: Iterable[str]) -> dict[str, str]:
+        """Validators for the url, only if verdicts for all requested keys are known"""
+        entry = self.get(url)
+        if entry is None or any(key not in entry.verdicts for key in verdict_keys):
+            return {}
+        headers = {}
+        if entry.etag is not None:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified is not None:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def update(
+        self,
+        url: yarl.URL,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        verdicts: dict[str, Optional[str]],
+        fingerprint: Optional[str] = None,
+    ):
+        """Merge verdicts for the content. Fingerprint is the body's sha256 if it was read fully"""
+        entry = self.get(url)
+        if entry is None:
+            entry = SiteWatchHttpCache(url=str(url), verdicts={})
+            self._entries[entry.url] = entry
+        if (
+            entry.etag != etag
+            or entry.last_modified != last_modified
+            or (fingerprint is not None and entry.fingerprint != fingerprint)
+        ):
+            # Content changed, verdicts for other values are stale
+            entry.etag = etag
+            entry.last_modified = last_modified
+            entry.verdicts = {}
+        if fingerprint is not None:
+            entry.fingerprint = fingerprint
+        entry.verdicts = {**entry.verdicts, **verdicts}
+        self._dirty.add(entry.url)
+
+    def pop_dirty(self) -> list[SiteWatchHttpCache]:
+        result = [self._entries[url] for url in self._dirty]
+        self._dirty.clear()
+        return result
+
+
+class FingerprintStore:
+    """
+    In-memory view of content fingerprints for one run, per target and "changed" watch, so that checks
+    of other targets or watches don't hide a change from a suspended one. Changed entries are saved by the manager.
+    """
+
+    def __init__(self, entries: list[SiteWatchFingerprint]):
+        self._entries = {(entry.target, entry.url, entry.watch): entry for entry in entries}
+        self._dirty: set[tuple[str, str, str]] = set()
+
+    def get(self, target: str, url: yarl.URL, watch: str) -> Optional[str]:
+        entry = self._entries.get((target, str(url), watch))
+        return entry.fingerprint if entry is not None else None
+
+    def update(self, target: str, url: yarl.URL, watch: str, fingerprint: str) -> Optional[str]:
+        """Store the new fingerprint. Returns the previous one"""
+        key = (target, str(url), watch)
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = SiteWatchFingerprint(target=target, url=str(url), watch=watch, fingerprint=fingerprint)
+            self._dirty.add(key)
+            return None
+        previous = entry.fingerprint
+        if previous != fingerprint:
+            entry.fingerprint = fingerprint
+            entry.changed_at = datetime.now()
+        self._dirty.add(key)
+        return previous
+
+    def pop_dirty(self) -> list[SiteWatchFingerprint]:
+        result = [self._entries[url] for url in self._dirty]
+        self._dirty.clear()
+        return result
+
+
+class CheckSchedule:
+    """
+    Adaptive per-url check intervals for one run. A url starts at the base interval, usually the run interval.
+    The interval is halved when the check outcome changes and grows by BACKOFF when it stays the same,
+    within the given bounds.
+    """
+
+    BACKOFF = 1.5
+
+    def __init__(self, entries: list[SiteWatchUrlStats]):
+        self._entries = {entry.url: entry for entry in entries}
+        self._dirty: set[str] = set()
+
+    def is_due(self, url: yarl.URL, now: datetime) -> bool:
+        entry = self._entries.get(str(url))
+        return entry is None or entry.next_check_at <= now
+
+    def record(
+        self,
+        url: yarl.URL,
+        signature: Optional[str],
+        min_interval: timedelta,
+        max_interval: timedelta,
+        base_interval: timedelta,
+    ) -> timedelta:
+        """Record a check outcome, signature None means an error. Returns the delay until the next check"""
+        low, high = min_interval.total_seconds(), max_interval.total_seconds()
+        if low <= 0:
+            raise ValueError("min_interval must be positive, got {}".format(min_interval))
+        # Intervals only change by multiplying, so they must start above zero
+        start = min(max(low, base_interval.total_seconds()), high)
+        entry = self._entries.get(str(url))
+        if entry is None:
+            entry = SiteWatchUrlStats(url=str(url), interval=start, checks=0, changes=0, errors=0)
+            self._entries[entry.url] = entry
+        elif entry.interval <= 0:
+            entry.interval = start
+        entry.checks += 1
+        if signature is None:
+            entry.errors += 1
+            delay = low
+        else:
+            if entry.last_signature is None:
+                interval = entry.interval
+            elif entry.last_signature != signature:
+                entry.changes += 1
+                interval = entry.interval / 2
+            else:
+                interval = entry.interval * self.BACKOFF
+            entry.last_signature = signature
+            entry.interval = min(max(interval, low), high)
+            delay = entry.interval
+        entry.next_check_at = datetime.now() + timedelta(seconds=delay)
+        self._dirty.add(entry.url)
+        return timedelta(seconds=delay)
+
+    def pop_dirty(self) -> list[SiteWatchUrlStats]:
+        result = [self._entries[url] for url in self._dirty]
+        self._dirty.clear()
+        return result
+
+
 class SiteWatcherManager:
     def __init__(self, db: DB):
         self.db = db
@@ -33,7 +195,44 @@ class SiteWatcherManager:
             result = await session.execute(stmt)
             return SuspensionChecker(suspensions=list(result.scalars()))
 
-    async def suspend(self, suspension: SiteWatchSuspension):
+    async def suspend(self, suspension: SiteWatchSuspension, notifications: Sequence[Notification] = ()):
+        """Insert the suspension together with the notifications about it in one transaction"""
         async with self.db.session() as session:
+            await insert_notifications(session, notifications)
             session.add(suspension)
             await session.commit()
+
+    async def get_http_cache(self) -> HttpValidatorCache:
+        async with self.db.session() as session:
+            result = await session.execute(select(SiteWatchHttpCache))
+            return HttpValidatorCache(entries=list(result.scalars()))
+
+    async def save_http_cache(self, cache: HttpValidatorCache):
+        await self._save_entries(cache.pop_dirty())
+
+    async def get_fingerprints(self) -> FingerprintStore:
+        async with self.db.session() as session:
+            result = await session.execute(select(SiteWatchFingerprint))
+            return FingerprintStore(entries=list(result.scalars()))
+
+    async def save_fingerprints(self, store: FingerprintStore):
+        await self._save_entries(store.pop_dirty())
+
+    async def get_check_schedule(self) -> CheckSchedule:
+        async with self.db.session() as session:
+            result = await session.execute(select(SiteWatchUrlStats))
+            return CheckSchedule(entries=list(result.scalars()))
+
+    async def save_check_schedule(self, schedule: CheckSchedule):
+        await self._save_entries(schedule.pop_dirty())
+
+    async def _save_entries(self, entries: Sequence[SiteWatchHttpCache | SiteWatchFingerprint | SiteWatchUrlStats]):
+        if not entries:
+            return
+        async with self.db.session() as session:
+            for entry in entries:
+                if entry.id is None:
+                    session.add(entry)
+                else:
+                    await session.merge(entry)
+            await session.commit()
@@ -0,0 +1,295 @@
+import abc
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Any, AsyncIterable, Iterable
+
+import lxml.etree
+import lxml.html
+from lxml.cssselect import CSSSelector
+
+
+class BodyTooLargeException(Exception):
+    pass
+
+
+class NeedleSet:
+    """
+    Compiled set of byte strings to search for. Immutable, so one compiled set serves any number of scans.
+    """
+
+    def __init__(self, needles: Iterable[bytes]):
+        self.needles = frozenset(needles)
+        if not self.needles or b"" in self.needles:
+            raise ValueError("Empty needle")
+        # Longest first, so at every position the longest needle starting there wins
+        ordered = sorted(self.needles, key=len, reverse=True)
+        self.pattern = re.compile(b"(?=(" + b"|".join(re.escape(needle) for needle in ordered) + b"))")
+        # A needle hidden by a longer one matched at the same position is its substring
+        self.implied = {
+            needle: frozenset(other for other in self.needles if other != needle and other in needle)
+            for needle in self.needles
+        }
+        self.tail_size = len(ordered[0]) - 1
+
+
+class StreamingMatcher:
+    """
+    Searches for a set of byte strings in a stream of chunks in a single pass,
+    including matches crossing chunk boundaries. Holds the state of one scan.
+    """
+
+    def __init__(self, needles: NeedleSet | Iterable[bytes]):
+        self._compiled = needles if isinstance(needles, NeedleSet) else NeedleSet(needles)
+        self.needles = self._compiled.needles
+        self.found: set[bytes] = set()
+        self._tail = b""
+
+    @property
+    def done(self) -> bool:
+        return len(self.found) == len(self.needles)
+
+    def feed(self, chunk: bytes) -> bool:
+        """Returns True when all needles are found."""
+        if self.done:
+            return True
+        data = self._tail + chunk
+        for match in self._compiled.pattern.finditer(data):
+            needle = match.group(1)
+            if needle not in self.found:
+                self.found.add(needle)
+                self.found.update(self._compiled.implied[needle])
+                if self.done:
+                    break
+        tail_size = self._compiled.tail_size
+        self._tail = data[-tail_size:] if tail_size else b""
+        return self.done
+
+
+@dataclass
+class ScanResult:
+    size: int
+    # Only set when the body was requested and the whole stream was read
+    body: bytes | None
+    # sha256 of the whole body, only set when the whole stream was read
+    fingerprint: str | None
+
+
+async def scan_stream(
+    chunks: AsyncIterable[bytes],
+    matcher: StreamingMatcher | None,
+    max_size: int,
+    keep_body: bool,
+    read_all: bool = False,
+) -> ScanResult:
+    """
+    Feed chunks to the matcher until everything is found or the stream ends. With read_all the whole stream is read.
+    Body is only returned when keep_body or read_all is set and the whole stream was read.
+    """
+    size = 0
+    body = [] if keep_body or read_all else None
+    digest = hashlib.sha256()
+    async for chunk in chunks:
+        size += len(chunk)
+        digest.update(chunk)
+        found_all = matcher is not None and matcher.feed(chunk)
+        if found_all and not read_all:
+            return ScanResult(size=size, body=None, fingerprint=None)
+        if size > max_size:
+            raise BodyTooLargeException("Body is larger than {} bytes".format(max_size))
+        if body is not None:
+            body.append(chunk)
+    return ScanResult(
+        size=size, body=b"".join(body) if body is not None else None, fingerprint=digest.hexdigest(),
+    )
+
+
+class Document:
+    """Downloaded page, parsed lazily and at most once for all checks of the page"""
+
+    def __init__(self, body: bytes, encoding: str):
+        self.body = body
+        self.encoding = encoding
+
+    @cached_property
+    def text(self) -> str:
+        return self.body.decode(self.encoding, errors="replace")
+
+    @cached_property
+    def html(self) -> lxml.etree._Element:
+        return lxml.html.document_fromstring(self.body)
+
+    @cached_property
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+class DocumentCheck(abc.ABC):
+    """Precompiled check that needs the whole body. Returns None if ok, or a message to notify with."""
+
+    @abc.abstractmethod
+    def check(self, document: Document) -> str | None:
+        pass
+
+
+class RegexCheck(DocumentCheck):
+    def __init__(self, pattern: str):
+        try:
+            self._pattern = re.compile(pattern)
+        except re.error as e:
+            raise ValueError("Invalid regex '{}': {}".format(pattern, e)) from e
+
+    def check(self, document: Document) -> str | None:
+        if self._pattern.search(document.text) is None:
+            return "Pattern '{}' does not match the site's text anymore".format(self._pattern.pattern)
+        return None
+
+
+class _SelectorCheck(DocumentCheck, abc.ABC):
+    def __init__(self, selector: str, value: str):
+        self.selector = selector
+        self.value = value
+
+    @abc.abstractmethod
+    def extract(self, document: Document) -> list[str]:
+        """Texts of the selected nodes or values"""
+
+    def check(self, document: Document) -> str | None:
+        if not any(self.value in text for text in self.extract(document)):
+            return "Message '{}' is not in '{}' anymore".format(self.value, self.selector)
+        return None
+
+
+def _node_text(node: Any) -> str:
+    if isinstance(node, lxml.etree._Element):
+        return node.text_content() if isinstance(node, lxml.html.HtmlElement) else "".join(node.itertext())
+    return str(node)
+
+
+class CssCheck(_SelectorCheck):
+    def __init__(self, selector: str, value: str):
+        super().__init__(selector, value)
+        try:
+            self._compiled = CSSSelector(selector)
+        except Exception as e:
+            raise ValueError("Invalid CSS selector '{}': {}".format(selector, e)) from e
+
+    def extract(self, document: Document) -> list[str]:
+        return [_node_text(node) for node in self._compiled(document.html)]
+
+
+class XPathCheck(_SelectorCheck):
+    def __init__(self, selector: str, value: str):
+        super().__init__(selector, value)
+        try:
+            self._compiled = lxml.etree.XPath(selector)
+        except lxml.etree.XPathSyntaxError as e:
+            raise ValueError("Invalid XPath '{}': {}".format(selector, e)) from e
+
+    def extract(self, document: Document) -> list[str]:
+        result = self._compiled(document.html)
+        if not isinstance(result, list):
+            result = [result]
+        return [_node_text(node) for node in result]
+
+
+_JSON_PATH_TOKEN = re.compile(r"""\.(\*|[A-Za-z_][\w-]*)|\[(\*|-?\d+|'[^']*'|"[^"]*")]""")
+
+
+def compile_json_path(path: str) -> list[str | int | None]:
+    """
+    Compile a JSONPath subset: $, .key, ['key'], [index], .* and [*].
+    Returns steps: str for keys, int for indexes, None for wildcards.
+    """
+    if not path.startswith("$"):
+        raise ValueError("Invalid JSON path '{}': must start with $".format(path))
+    steps = []
+    pos = 1
+    while pos < len(path):
+        match = _JSON_PATH_TOKEN.match(path, pos)
+        if match is None:
+            raise ValueError("Invalid JSON path '{}' at position {}".format(path, pos))
+        token = match.group(1) if match.group(1) is not None else match.group(2)
+        if token == "*":
+            steps.append(None)
+        elif token[0] in "'\"":
+            steps.append(token[1:-1])
+        elif match.group(2) is not None:
+            steps.append(int(token))
+        else:
+            steps.append(token)
+        pos = match.end()
+    return steps
+
+
+def _walk_json(values: list[Any], step: str | int | None) -> list[Any]:
+    result = []
+    for value in values:
+        if step is None:
+            if isinstance(value, dict):
+                result.extend(value.values())
+            elif isinstance(value, list):
+                result.extend(value)
+        elif isinstance(step, int):
+            if isinstance(value, list) and -len(value) <= step < len(value):
+                result.append(value[step])
+        elif isinstance(value, dict) and step in value:
+            result.append(value[step])
+    return result
+
+
+class JsonPathCheck(_SelectorCheck):
+    def __init__(self, selector: str, value: str):
+        super().__init__(selector, value)
+        self._steps = compile_json_path(selector)
+
+    def extract(self, document: Document) -> list[str]:
+        values = [document.json]
+        for step in self._steps:
+            values = _walk_json(values, step)
+        return [value if isinstance(value, str) else json.dumps(value, ensure_ascii=False) for value in values]
+
+
+def make_selector_check(selector: str, value: str = "") -> _SelectorCheck:
+    """Selector check with the selector language detected: JSON path if it starts with $, XPath with / or (, else CSS"""
+    if selector.startswith("$"):
+        return JsonPathCheck(selector, value)
+    if selector.startswith(("/", "(")):
+        return XPathCheck(selector, value)
+    return CssCheck(selector, value)
+
+
+_VISIBLE_TEXT = lxml.etree.XPath(
+    "//text()[not(ancestor::script or ancestor::style or ancestor::noscript or ancestor::template)]"
+)
+
+
+def _visible_text(document: Document) -> str:
+    try:
+        return "".join(_VISIBLE_TEXT(document.html))
+    except (lxml.etree.ParserError, ValueError):
+        return document.text
+
+
+class ContentFingerprint:
+    """
+    Fingerprint of a page's relevant content: the texts selected by the selector, or the visible text of the page.
+    Markup, attributes (e.g. CSRF tokens), scripts, styles and whitespace don't change it.
+    """
+
+    def __init__(self, selector: str | None = None):
+        self.selector = selector
+        self._selector_check = make_selector_check(selector) if selector is not None else None
+
+    def fingerprint(self, document: Document) -> str:
+        if self._selector_check is not None:
+            texts = self._selector_check.extract(document)
+        else:
+            texts = [_visible_text(document)]
+        digest = hashlib.sha256()
+        for text in texts:
+            digest.update(" ".join(text.split()).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
@@ -0,0 +1,97 @@
+import logging
+from collections import deque
+
+from kotiki.core.interfaces import CronRunner
+
+log = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(ordered: list[float], p: float) -> float | None:
+    """Nearest-rank p-th percentile of sorted values, None if empty"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+class Histogram:
+    """Keeps the last max_samples values for percentiles, and totals over all values"""
+
+    def __init__(self, max_samples: int = 10000):
+        self._samples: deque[float] = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self._samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentile(self, p: float) -> float | None:
+        return percentile(sorted(self._samples), p)
+
+    def snapshot(self) -> dict[str, float | None]:
+        ordered = sorted(self._samples)
+        result: dict[str, float | None] = {"count": self.count, "sum": self.total}
+        for p in PERCENTILES:
+            result["p{}".format(p)] = percentile(ordered, p)
+        result["max"] = ordered[-1] if ordered else None
+        return result
+
+
+class MetricsRegistry:
+    """In-process registry of histograms and gauges, queryable with snapshot()"""
+
+    def __init__(self):
+        self._histograms: dict[str, Histogram] = {}
+        self._gauges: dict[str, float] = {}
+
+    def histogram(self, name: str) -> Histogram:
+        if name not in self._histograms:
+            self._histograms[name] = Histogram()
+        return self._histograms[name]
+
+    def observe(self, name: str, value: float):
+        self.histogram(name).observe(value)
+
+    def set_gauge(self, name: str, value: float):
+        self._gauges[name] = value
+
+    def snapshot(self) -> dict[str, dict | float]:
+        result: dict[str, dict | float] = {name: h.snapshot() for name, h in sorted(self._histograms.items())}
+        result.update(sorted(self._gauges.items()))
+        return result
+
+    def summary(self) -> str:
+        lines = []
+        for name, histogram in sorted(self._histograms.items()):
+            snapshot = histogram.snapshot()
+            if not snapshot["count"]:
+                continue
+            lines.append("{}: count={} {} max={:.3f}".format(
+                name, snapshot["count"],
+                " ".join("p{}={:.3f}".format(p, snapshot["p{}".format(p)]) for p in PERCENTILES),
+                snapshot["max"],
+            ))
+        for name, value in sorted(self._gauges.items()):
+            lines.append("{}: {}".format(name, value))
+        return "\n".join(lines)
+
+
+metrics = MetricsRegistry()
+
+
+class MetricsReporter(CronRunner):
+    """Logs a summary of the registry, run it periodically"""
+
+    def __init__(self, registry: MetricsRegistry):
+        self._registry = registry
+
+    async def run(self):
+        summary = self._registry.summary()
+        if summary:
+            log.info("Metrics summary:\n{}".format(summary))
+
+    def __str__(self):
+        return "MetricsReporter"
@@ -1,7 +1,7 @@
 from dataclasses import dataclass, field
 from datetime import timedelta
 from pathlib import Path
-from typing import Literal
+from typing import Literal, Optional
 
 import yaml
 
@@ -33,6 +33,56 @@ class SqliteConfig:
 class SiteWatcherConfig:
     request_timeout: float = 10.0
     suspension_time: timedelta = timedelta(days=1)
+    conditional_requests: bool = True
+    max_body_size: int = 10 * 1024 * 1024
+    read_chunk_size: int = 64 * 1024
+    max_concurrency: int = 20
+    per_host_concurrency: int = 2
+    per_host_interval: timedelta = timedelta(seconds=1)
+    # Retention of page archives in targets' log_dir
+    log_max_age: Optional[timedelta] = timedelta(days=90)
+    log_max_size: Optional[int] = 512 * 1024 * 1024
+    # Adaptive check intervals, enabled when max_check_interval is set here or in a target
+    min_check_interval: timedelta = timedelta(minutes=1)
+    max_check_interval: Optional[timedelta] = None
+
+
+@dataclass
+class NotificationsConfig:
+    batch_size: int = 100
+    lease_time: timedelta = timedelta(minutes=5)
+    retry_delay: timedelta = timedelta(seconds=30)
+    max_attempts: int = 10
+    # Telegram limits: about 30 messages per second overall, 1 per second per chat, 20 per minute per group
+    concurrency: int = 10
+    global_rate: float = 30.0
+    chat_rate: float = 1.0
+    group_chat_rate: float = 20 / 60
+    max_flood_retries: int = 3
+    # Merge pending notifications to the same chat into as few messages as fit Telegram's size limit
+    digest: bool = True
+    max_message_length: int = 4096
+    # Delivery from the bot process as soon as notifications are inserted
+    push_delivery: bool = True
+    poll_interval: timedelta = timedelta(seconds=1)
+    idle_interval: timedelta = timedelta(seconds=30)
+
+
+@dataclass
+class SensorsCacheConfig:
+    enabled: bool = True
+    ttl: timedelta = timedelta(seconds=10)
+    # Per endpoint TTLs by path prefix, the longest matching prefix wins, e.g. {"/sensors/boiler": 60}
+    endpoint_ttls: dict[str, timedelta] = field(default_factory=dict)
+    max_size: int = 256
+    # Answer with expired data up to this long after the TTL, while refreshing it in background
+    stale_while_revalidate: Optional[timedelta] = None
+
+
+@dataclass
+class DaemonConfig:
+    site_watcher_interval: timedelta = timedelta(minutes=5)
+    notifications_interval: timedelta = timedelta(seconds=30)
 
 
 @dataclass
@@ -49,8 +99,14 @@ class Config:
 
     db: PgConfig | SqliteConfig
     sensors_api: str
+    sensors_api_timeout: float = 10.0
+    sensors_api_connections: int = 10
+    sensors_cache: SensorsCacheConfig = field(default_factory=SensorsCacheConfig)
 
     site_watcher: SiteWatcherConfig = field(default_factory=SiteWatcherConfig)
+    daemon: DaemonConfig = field(default_factory=DaemonConfig)
+    notifications: NotificationsConfig = field(default_factory=NotificationsConfig)
+    metrics_log_interval: timedelta = timedelta(minutes=10)
 
     aliases: list[Alias] = field(default_factory=list)
 
@@ -70,4 +126,9 @@ retort = base_retort
 
 def parse_config(config_path: Path) -> Config:
     with open(config_path, "r", encoding="utf-8") as f:
-        return retort.load(yaml.safe_load(f), Config)
+        result = retort.load(yaml.safe_load(f), Config)
+
+    if result.site_watcher.min_check_interval <= timedelta(0):
+        raise ValueError("site_watcher.min_check_interval must be positive")
+
+    return result
@@ -1,6 +1,7 @@
 from datetime import datetime
+from typing import Optional
 
-from sqlalchemy import func
+from sqlalchemy import JSON, Float, Index, UniqueConstraint, func
 from sqlalchemy.orm import declarative_base, Mapped, mapped_column
 
 Base = declarative_base()
@@ -8,11 +9,24 @@ Base = declarative_base()
 
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        Index("ix_notifications_next_attempt_at_created_at", "next_attempt_at", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True, autoincrement=True)
     chat_id: Mapped[str]
     message: Mapped[str]
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+    attempts: Mapped[int] = mapped_column(default=0, server_default="0")
+    first_attempt_at: Mapped[Optional[datetime]]
+    # Set to created_at on insert, so that the claim query can range scan the index
+    next_attempt_at: Mapped[datetime] = mapped_column(default=datetime.now)
+    leased_until: Mapped[Optional[datetime]]
+    lease_token: Mapped[Optional[str]]
+    # sha256 of chat and dedup key, unique among pending notifications
+    content_hash: Mapped[Optional[str]] = mapped_column(unique=True, index=True)
+    # Number of identical notifications collapsed into this one
+    duplicates: Mapped[int] = mapped_column(default=0, server_default="0")
 
 
 class SiteWatchSuspension(Base):
@@ -25,3 +39,51 @@ class SiteWatchSuspension(Base):
     value: Mapped[str]
     suspended_until: Mapped[datetime]
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+
+class SiteWatchHttpCache(Base):
+    __tablename__ = 'site_watch_http_cache'
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True, autoincrement=True)
+    url: Mapped[str] = mapped_column(unique=True)
+    etag: Mapped[Optional[str]]
+    last_modified: Mapped[Optional[str]]
+    # Last check result per "<watch_type>:<value>" for the content identified by the validators,
+    # for "changed" watches the ContentFingerprint of the content
+    verdicts: Mapped[dict] = mapped_column(JSON, default=dict)
+    # sha256 of the body the verdicts were made for, when it was read fully
+    fingerprint: Mapped[Optional[str]]
+    updated_at: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())
+
+
+class SiteWatchFingerprint(Base):
+    __tablename__ = 'site_watch_fingerprints'
+    __table_args__ = (
+        UniqueConstraint("target", "url", "watch"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True, autoincrement=True)
+    target: Mapped[str]
+    url: Mapped[str]
+    # Verdict key of the "changed" watch
+    watch: Mapped[str]
+    # ContentFingerprint of the watch's relevant content at the last check
+    fingerprint: Mapped[str]
+    changed_at: Mapped[datetime] = mapped_column(server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())
+
+
+class SiteWatchUrlStats(Base):
+    __tablename__ = 'site_watch_url_stats'
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True, autoincrement=True)
+    url: Mapped[str] = mapped_column(unique=True)
+    # Current adaptive check interval, seconds
+    interval: Mapped[float] = mapped_column(Float)
+    next_check_at: Mapped[datetime]
+    # Digest of the last check outcome: notifying verdicts and content fingerprint
+    last_signature: Mapped[Optional[str]]
+    checks: Mapped[int] = mapped_column(default=0)
+    changes: Mapped[int] = mapped_column(default=0)
+    errors: Mapped[int] = mapped_column(default=0)
+    updated_at: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())
@@ -13,14 +13,28 @@ from kotiki.core.models.retort import base_retort
 
 class WatchType(Enum):
     TEXT = "text"
+    REGEX = "regex"
+    CSS = "css"
+    XPATH = "xpath"
+    JSON_PATH = "json_path"
+    # Notify when the page's relevant content changes: the selected content, or the visible text. Value is not used
+    CHANGED = "changed"
+
+
+SELECTOR_WATCH_TYPES = (WatchType.CSS, WatchType.XPATH, WatchType.JSON_PATH)
+# Selector is optional for these
+OPTIONAL_SELECTOR_WATCH_TYPES = (WatchType.CHANGED,)
 
 
 @dataclass
 class WatchURL:
     url: yarl.URL
-    value: str
+    value: str = ""
     watch_type: WatchType = WatchType.TEXT
     comment: Optional[str] = None
+    # CSS selector, XPath or JSON path for selector watch types. Value is searched in the selected content.
+    # Optional for "changed" watches, where the language is detected: $ starts a JSON path, / or ( an XPath
+    selector: Optional[str] = None
 
 
 @dataclass
@@ -30,6 +44,9 @@ class WatchTarget:
     urls: list[WatchURL]
     suspension_time: Optional[timedelta] = None
     log_dir: Optional[Path] = None
+    # Bounds for adaptive check intervals, override site_watcher config
+    min_check_interval: Optional[timedelta] = None
+    max_check_interval: Optional[timedelta] = None
 
 
 @dataclass
@@ -48,5 +65,22 @@ def parse_watch_config(config_path: Path, config: Config) -> WatcherConfig:
         for contact in target.contacts:
             if contact not in config.contacts:
                 raise ValueError("Target {} contact {} not found in config".format(target.name, contact))
+        if target.min_check_interval is not None and target.min_check_interval <= timedelta(0):
+            raise ValueError("Target {}: min_check_interval must be positive".format(target.name))
+        for url_config in target.urls:
+            if not url_config.value and url_config.watch_type != WatchType.CHANGED:
+                raise ValueError("Target {} url {}: value is required for {} watch type".format(
+                    target.name, url_config.url, url_config.watch_type.value,
+                ))
+            if url_config.selector is None and url_config.watch_type in SELECTOR_WATCH_TYPES:
+                raise ValueError("Target {} url {}: selector is required for {} watch type".format(
+                    target.name, url_config.url, url_config.watch_type.value,
+                ))
+            if url_config.selector is not None and (
+                url_config.watch_type not in SELECTOR_WATCH_TYPES + OPTIONAL_SELECTOR_WATCH_TYPES
+            ):
+                raise ValueError("Target {} url {}: selector is not used for {} watch type".format(
+                    target.name, url_config.url, url_config.watch_type.value,
+                ))
 
     return result
@@ -0,0 +1,159 @@
+import abc
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from kotiki.core.db import DB
+from kotiki.core.interfaces import CronRunner
+from kotiki.core.managers.notifications_manager import NOTIFY_CHANNEL
+from kotiki.core.models.config import NotificationsConfig, PgConfig, SqliteConfig
+
+log = logging.getLogger(__name__)
+
+
+class Wakeup(abc.ABC):
+    """Signals that new notifications may have been inserted"""
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abc.abstractmethod
+    async def wait(self, timeout: float) -> bool:
+        """Wait for a signal up to timeout seconds. Returns True if woken by a signal"""
+        pass
+
+
+class PgWakeup(Wakeup):
+    """LISTEN on the notifications channel, inserts send NOTIFY on commit"""
+
+    def __init__(self, db: DB):
+        self._db = db
+        self._event = asyncio.Event()
+        self._connection: Optional[AsyncConnection] = None
+
+    def _on_notify(self, *args):
+        self._event.set()
+
+    async def start(self):
+        connection = await self._db.engine.connect()
+        try:
+            raw = await connection.get_raw_connection()
+            await raw.driver_connection.add_listener(NOTIFY_CHANNEL, self._on_notify)
+        except BaseException:
+            await connection.close()
+            raise
+        self._connection = connection
+        log.info("Listening for notifications on channel {}".format(NOTIFY_CHANNEL))
+
+    async def close(self):
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+    async def _ensure_connected(self):
+        if self._connection is not None:
+            raw = await self._connection.get_raw_connection()
+            if not raw.driver_connection.is_closed():
+                return
+            log.warning("Notifications listener connection lost, reconnecting")
+            await self._connection.invalidate()
+            self._connection = None
+        await self.start()
+        # Anything inserted while disconnected was missed
+        self._event.set()
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await self._ensure_connected()
+        except Exception:
+            log.exception("Exception connecting notifications listener")
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._event.clear()
+        return True
+
+
+class FileWakeup(Wakeup):
+    """Polls modification time of the SQLite database files, which is much cheaper than querying"""
+
+    def __init__(self, paths: list[Path], poll_interval: float):
+        self._paths = paths
+        self._poll_interval = poll_interval
+        self._last: Optional[tuple[float, ...]] = None
+
+    def _stat(self) -> tuple[float, ...]:
+        result = []
+        for path in self._paths:
+            try:
+                result.append(os.stat(path).st_mtime)
+            except FileNotFoundError:
+                result.append(0.0)
+        return tuple(result)
+
+    async def start(self):
+        self._last = self._stat()
+
+    async def wait(self, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            await asyncio.sleep(min(self._poll_interval, max(deadline - loop.time(), 0)))
+            current = self._stat()
+            if current != self._last:
+                self._last = current
+                return True
+        return False
+
+
+def create_wakeup(db: DB, config: NotificationsConfig) -> Wakeup:
+    if isinstance(db.config.db, PgConfig):
+        return PgWakeup(db)
+    elif isinstance(db.config.db, SqliteConfig):
+        path = db.config.db.path
+        return FileWakeup(
+            paths=[path, path.with_name(path.name + "-wal")], poll_interval=config.poll_interval.total_seconds(),
+        )
+    else:
+        raise RuntimeError("Unsupported db type: {}".format(db.config.db))
+
+
+class NotificationConsumer:
+    """Runs the notification executor whenever new notifications arrive, and periodically for retries"""
+
+    def __init__(self, config: NotificationsConfig, executor: CronRunner, wakeup: Wakeup):
+        self._config = config
+        self._executor = executor
+        self._wakeup = wakeup
+
+    async def _start_wakeup(self):
+        """Start the wakeup, retrying with exponential backoff up to idle_interval, e.g. while the db is down"""
+        delay = 1.0
+        while True:
+            try:
+                await self._wakeup.start()
+                return
+            except Exception:
+                log.exception("Exception starting notification wakeup, retrying in {:.0f}s".format(delay))
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self._config.idle_interval.total_seconds())
+
+    async def run(self):
+        try:
+            await self._start_wakeup()
+            while True:
+                try:
+                    await self._executor.run()
+                except Exception:
+                    log.exception("Exception in notification consumer")
+                await self._wakeup.wait(timeout=self._config.idle_interval.total_seconds())
+        finally:
+            await self._wakeup.close()
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import signal
+from dataclasses import dataclass
+from datetime import timedelta
+
+from kotiki.core.interfaces import CronRunner
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class ScheduledRunner:
+    runner: CronRunner
+    interval: timedelta
+
+
+class Scheduler:
+    """Runs cron runners periodically inside one event loop until stopped."""
+
+    def __init__(self, runners: list[ScheduledRunner]):
+        self._runners = runners
+        self._stop = asyncio.Event()
+
+    def stop(self):
+        log.info("Stopping scheduler")
+        self._stop.set()
+
+    def install_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for sig in signal.SIGINT, signal.SIGTERM:
+            loop.add_signal_handler(sig, self.stop)
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=max(seconds, 0))
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run_periodic(self, scheduled: ScheduledRunner):
+        loop = asyncio.get_running_loop()
+        interval = scheduled.interval.total_seconds()
+        while not self._stop.is_set():
+            started = loop.time()
+            log.debug("Running task {}".format(scheduled.runner))
+            try:
+                await scheduled.runner.run()
+            except Exception:
+                log.exception("Exception in executor {}".format(scheduled.runner.__class__.__name__))
+            elapsed = loop.time() - started
+            if elapsed > interval:
+                log.warning("Task {} took {:.1f}s, longer than its interval {:.1f}s".format(
+                    scheduled.runner, elapsed, interval,
+                ))
+            await self._sleep(interval - elapsed)
+
+    async def run(self):
+        """Run until stop() is called. A run in progress is allowed to finish before returning."""
+        async with asyncio.TaskGroup() as task_group:
+            for scheduled in self._runners:
+                task_group.create_task(self._run_periodic(scheduled))
+        log.info("Scheduler stopped")
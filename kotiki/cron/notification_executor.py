@@ -1,50 +1,35 @@
 import logging
 
 from aiogram import Bot
-from aiogram.exceptions import AiogramError
-from tenacity import retry, stop_after_attempt, wait_exponential, before_sleep_log, retry_if_exception_type
 
+from kotiki.core.delivery import DeliveryEngine
 from kotiki.core.interfaces import CronRunner
+from kotiki.core.metrics import metrics
 from kotiki.core.models.config import Config
-from kotiki.core.models.db import Notification
 from kotiki.core.managers.notifications_manager import NotificationsManager
 
 log = logging.getLogger(__name__)
 
 
-bot_retry = retry(
-    retry=retry_if_exception_type(AiogramError),
-    stop=stop_after_attempt(5),
-    wait=wait_exponential(),
-    before_sleep=before_sleep_log(log, logging.WARNING),
-)
-
-
 class NotificationExecutor(CronRunner):
     def __init__(self, config: Config, bot: Bot, manager: NotificationsManager):
         self._config = config
         self._bot = bot
         self._manager = manager
-
-    @bot_retry
-    async def _delete(self, notification: Notification):
-        await self._manager.delete(notification)
-
-    @bot_retry
-    async def _send(self, notification: Notification):
-        await self._bot.send_message(notification.chat_id, notification.message)
-        try:
-            await self._delete(notification)
-        except Exception:
-            log.exception(f"Error deleting notification: {notification}")
+        self._engine = DeliveryEngine(config=config.notifications, bot=bot, manager=manager)
 
     async def run(self):
-        async for notification in self._manager.generate_actual():
-            log.debug(f"Executing notification: {notification}")
-            try:
-                await self._send(notification)
-            except Exception:
-                log.exception(f"Exception sending notification: {notification}")
+        config = self._config.notifications
+        depth = await self._manager.count_pending()
+        metrics.set_gauge("notifications.queue_depth_last", depth)
+        metrics.observe("notifications.queue_depth", depth)
+        if depth:
+            log.info("{} notifications in queue".format(depth))
+        while True:
+            batch = await self._manager.claim(limit=config.batch_size, lease_time=config.lease_time)
+            if not batch:
+                break
+            await self._engine.deliver(batch)
 
     def __str__(self):
         return "NotificationExecutor"
@@ -1,20 +1,32 @@
 import asyncio
+import hashlib
+import json
 import logging
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional
 
 import aiohttp
+import yarl
 from aiogram import Bot
 from aiohttp import ClientTimeout
 from tenacity import retry, stop_after_attempt, wait_exponential, before_sleep_log, retry_if_exception_type
 
+from kotiki.core.archive import PageArchive
+from kotiki.core.host_limiter import HostLimiter
 from kotiki.core.interfaces import CronRunner
-from kotiki.core.managers.site_watcher_manager import SiteWatcherManager
+from kotiki.core.managers.site_watcher_manager import (
+    CheckSchedule, FingerprintStore, HttpValidatorCache, SiteWatcherManager, SuspensionChecker,
+)
+from kotiki.core.matching import (
+    ContentFingerprint, CssCheck, Document, DocumentCheck, JsonPathCheck, NeedleSet, RegexCheck, StreamingMatcher,
+    XPathCheck, scan_stream,
+)
 from kotiki.core.models.config import Config
 from kotiki.core.models.db import Notification, SiteWatchSuspension
 from kotiki.core.models.site_watcher import WatcherConfig, WatchURL, WatchType, WatchTarget
-from kotiki.core.managers.notifications_manager import NotificationsManager
+from kotiki.core.managers.notifications_manager import make_content_hash
 from kotiki.core.utils import coalesce, make_browser_headers
 
 log = logging.getLogger(__name__)
@@ -24,6 +36,21 @@ class LocalException(Exception):
     pass
 
 
+@dataclass
+class UrlGroup:
+    """All non-suspended checks of one url in a run, across targets"""
+    url: yarl.URL
+    checks: list[tuple[WatchTarget, WatchURL]] = field(default_factory=list)
+
+
+@dataclass
+class RunState:
+    suspensions: SuspensionChecker
+    http_cache: Optional[HttpValidatorCache]
+    fingerprints: FingerprintStore
+    schedule: CheckSchedule
+
+
 aiohttp_retry = retry(
     retry=retry_if_exception_type((aiohttp.ClientError, LocalException)),
     stop=stop_after_attempt(5),
@@ -40,111 +67,416 @@ class SiteWatcher(CronRunner):
         bot: Bot,
         session: aiohttp.ClientSession,
         manager: SiteWatcherManager,
-        notifications_manager: NotificationsManager,
     ):
         self._config = config
         self._watcher_config = watcher_config
         self._bot = bot
         self._session = session
         self._manager = manager
-        self._notifications_manager = notifications_manager
+        self._document_checks = self._compile_document_checks()
+        self._content_fingerprints = self._compile_content_fingerprints()
+        # Compiled text values by the set of values checked together and the page encoding
+        self._needle_sets: dict[tuple[frozenset[str], str], NeedleSet] = {}
+        self._limiter = HostLimiter(
+            max_concurrency=config.site_watcher.max_concurrency,
+            per_host_concurrency=config.site_watcher.per_host_concurrency,
+            per_host_interval=config.site_watcher.per_host_interval.total_seconds(),
+        )
+        self._archives: dict[Path, PageArchive] = {}
+
+    def _compile_document_checks(self) -> dict[str, DocumentCheck]:
+        """Precompile checks for all non-text watches, by verdict key"""
+        checks = {}
+        for target in self._watcher_config.targets:
+            for url_config in target.urls:
+                key = self._verdict_key(url_config)
+                if url_config.watch_type in (WatchType.TEXT, WatchType.CHANGED) or key in checks:
+                    continue
+                elif url_config.watch_type == WatchType.REGEX:
+                    checks[key] = RegexCheck(url_config.value)
+                elif url_config.watch_type == WatchType.CSS:
+                    checks[key] = CssCheck(url_config.selector, url_config.value)
+                elif url_config.watch_type == WatchType.XPATH:
+                    checks[key] = XPathCheck(url_config.selector, url_config.value)
+                elif url_config.watch_type == WatchType.JSON_PATH:
+                    checks[key] = JsonPathCheck(url_config.selector, url_config.value)
+                else:
+                    raise RuntimeError("Unexpected watch type {}".format(url_config.watch_type))
+        return checks
 
-    async def _check_text(self, response: aiohttp.ClientResponse, value: str) -> Optional[str]:
-        text = await response.text()
-        if len(text) == 0:
+    def _compile_content_fingerprints(self) -> dict[str, ContentFingerprint]:
+        """Precompile relevant content selectors of "changed" watches, by verdict key"""
+        return {
+            self._verdict_key(url_config): ContentFingerprint(url_config.selector)
+            for target in self._watcher_config.targets
+            for url_config in target.urls
+            if url_config.watch_type == WatchType.CHANGED
+        }
+
+    def _needle_set(self, text_values: list[str], encoding: str) -> NeedleSet:
+        """Compiled text values, built on first use for each set of values and encoding"""
+        key = (frozenset(text_values), encoding)
+        if key not in self._needle_sets:
+            self._needle_sets[key] = NeedleSet(value.encode(encoding, errors="replace") for value in text_values)
+        return self._needle_sets[key]
+
+    async def _check_content(
+        self,
+        response: aiohttp.ClientResponse,
+        url: yarl.URL,
+        text_values: list[str],
+        document_keys: list[str],
+        changed_keys: list[str],
+        keep_body: bool,
+        state: RunState,
+    ) -> tuple[dict[str, Optional[str]], dict[str, str], Optional[str], Optional[str]]:
+        """
+        Check all text values in a single streaming pass, then run document checks and fingerprint the relevant
+        content of "changed" watches over the whole body if any. Document checks are skipped if the body
+        is unchanged and their verdicts are cached. A failed fingerprint is reported as a verdict for its key.
+        Returns (verdicts by verdict key, content fingerprints by verdict key, page body if keep_body,
+        body fingerprint if the whole body was read)
+        """
+        encoding = response.charset or "utf-8"
+        needles = {value: value.encode(encoding, errors="replace") for value in text_values}
+        matcher = StreamingMatcher(self._needle_set(text_values, encoding)) if needles else None
+        scan = await scan_stream(
+            response.content.iter_chunked(self._config.site_watcher.read_chunk_size),
+            matcher,
+            max_size=self._config.site_watcher.max_body_size,
+            keep_body=keep_body,
+            read_all=bool(document_keys or changed_keys),
+        )
+        if scan.size == 0:
             raise LocalException("No text in response, probably protection")
 
-        if value not in text:
-            return "Message '{}' is not in the site's text anymore".format(value)
+        verdicts = {}
+        for value, needle in needles.items():
+            key = HttpValidatorCache.make_verdict_key(WatchType.TEXT.value, value)
+            if needle not in matcher.found:
+                verdicts[key] = "Message '{}' is not in the site's text anymore".format(value)
+            else:
+                verdicts[key] = None
+
+        cache_entry = state.http_cache.get(url) if state.http_cache is not None else None
+        unchanged = (
+            scan.fingerprint is not None and cache_entry is not None and cache_entry.fingerprint == scan.fingerprint
+        )
+
+        document = Document(scan.body, encoding) if scan.body is not None else None
+        for key in document_keys:
+            if unchanged and cache_entry is not None and key in cache_entry.verdicts:
+                verdicts[key] = cache_entry.verdicts[key]
+                continue
+            try:
+                verdicts[key] = self._document_checks[key].check(document)
+            except Exception as e:
+                # E.g. an anti-bot page instead of JSON, or a broken selector: the watch can't be verified
+                log.exception("Exception while running check {} on site {}".format(key, url))
+                verdicts[key] = "Check failed: {}".format(e)
+
+        content_fingerprints = {}
+        for key in changed_keys:
+            try:
+                content_fingerprints[key] = self._content_fingerprints[key].fingerprint(document)
+            except Exception as e:
+                log.exception("Exception while fingerprinting {} on site {}".format(key, url))
+                verdicts[key] = "Check failed: {}".format(e)
+
+        return verdicts, content_fingerprints, scan.body if keep_body else None, scan.fingerprint
 
-        return None
+    @classmethod
+    def _compare_fingerprints(
+        cls,
+        url: yarl.URL,
+        changed_watches: list[tuple[WatchTarget, WatchURL]],
+        content_fingerprints: dict[str, str],
+        verdicts: dict[str, Optional[str]],
+        state: RunState,
+    ):
+        """
+        Add verdicts of "changed" watches, by comparing with each target's own last seen fingerprint.
+        A watch that was suspended is compared with what it saw before, so changes made meanwhile are reported.
+        """
+        for target, url_config in changed_watches:
+            key = cls._verdict_key(url_config)
+            if key not in content_fingerprints:
+                verdicts[cls._result_key(target, url_config)] = verdicts[key]
+                continue
+            previous = state.fingerprints.update(target.name, url, key, content_fingerprints[key])
+            changed = previous is not None and previous != content_fingerprints[key]
+            verdicts[cls._result_key(target, url_config)] = "Content changed" if changed else None
 
     def _suspend_timedelta(self, target: WatchTarget) -> timedelta:
         return coalesce(target.suspension_time, self._config.site_watcher.suspension_time)
 
-    @aiohttp_retry
-    async def _suspend(self, target: WatchTarget, url_config: WatchURL):
-        await self._manager.suspend(SiteWatchSuspension(
-            target=target.name,
-            url=str(url_config.url),
-            watch_type=url_config.watch_type.value,
-            value=url_config.value,
-            suspended_until=datetime.now() + self._suspend_timedelta(target),
-        ))
+    async def _queue_and_suspend(self, target: WatchTarget, url_config: WatchURL, notifications: list[Notification]):
+        """
+        Queue the notifications and suspend the watch in one transaction. Not retried here:
+        if it fails, nothing is suspended and the next run notifies again.
+        """
+        await self._manager.suspend(
+            SiteWatchSuspension(
+                target=target.name,
+                url=str(url_config.url),
+                watch_type=url_config.watch_type.value,
+                value=url_config.value,
+                suspended_until=datetime.now() + self._suspend_timedelta(target),
+            ),
+            notifications=notifications,
+        )
 
     async def _notify(self, target: WatchTarget, url_config: WatchURL, text: str):
         message = "{}: Site {}: {} since {}{}".format(
             target.name, url_config.url, text, datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             " ({})".format(url_config.comment) if url_config.comment is not None else "",
         )
-        for contact in target.contacts:
-            await self._notifications_manager.add(Notification(
+        # Same alert from another run differs only in time, don't queue it again while one is pending
+        dedup_key = "{}\n{}\n{}\n{}".format(target.name, url_config.url, self._verdict_key(url_config), text)
+        notifications = [
+            Notification(
                 chat_id=self._config.contacts[contact].id,
                 message=message,
-            ))
-            try:
-                await self._suspend(target, url_config)
-            except Exception:
-                log.exception("Exception trying to suspend watcher {} {}".format(target.name, url_config))
+                content_hash=make_content_hash(self._config.contacts[contact].id, dedup_key),
+            )
+            for contact in target.contacts
+        ]
+        if not notifications:
+            # Nobody would hear about it, keep checking like before
+            log.debug("No contacts for watch '{}', not suspending".format(target.name))
+            return
+        try:
+            await self._queue_and_suspend(target, url_config, notifications)
+        except Exception:
+            log.exception("Exception trying to notify and suspend watcher {} {}".format(target.name, url_config))
+
+    @staticmethod
+    def _verdict_key(url_config: WatchURL) -> str:
+        return HttpValidatorCache.make_verdict_key(url_config.watch_type.value, url_config.value, url_config.selector)
+
+    @classmethod
+    def _result_key(cls, target: WatchTarget, url_config: WatchURL) -> str:
+        """Key of the watch's verdict in a run. "changed" watches are tracked per target, the rest are shared"""
+        if url_config.watch_type == WatchType.CHANGED:
+            return "{}\n{}".format(target.name, cls._verdict_key(url_config))
+        return cls._verdict_key(url_config)
 
     @aiohttp_retry
-    async def _check_url_inner(self, target: WatchTarget, url_config: WatchURL) -> tuple[Optional[str], str]:
-        async with self._session.get(
-            url_config.url,
-            headers=make_browser_headers(),
+    async def _check_url_inner(
+        self, group: UrlGroup, state: RunState,
+    ) -> tuple[dict[str, Optional[str]], Optional[str]]:
+        """
+        Fetch the url once and check all values of the group.
+        Returns (verdicts by result key, page body)
+        """
+        http_cache = state.http_cache
+        changed_watches = {}
+        changed_keys = []
+        cached_keys = []
+        for target, url_config in group.checks:
+            key = self._verdict_key(url_config)
+            if url_config.watch_type == WatchType.CHANGED:
+                changed_watches[self._result_key(target, url_config)] = (target, url_config)
+                keys = changed_keys
+            else:
+                keys = cached_keys
+            if key not in keys:
+                keys.append(key)
+        headers = make_browser_headers()
+        if http_cache is not None:
+            # For "changed" watches the cache keeps the content fingerprint instead of a verdict
+            headers.update(http_cache.conditional_headers(group.url, cached_keys + changed_keys))
+        async with self._limiter.slot(group.url.host or "") as waited, self._session.get(
+            group.url,
+            headers=headers,
             timeout=ClientTimeout(total=self._config.site_watcher.request_timeout),
             ssl=False,
         ) as response:
+            log.debug("Site {} waited {:.2f}s in queue".format(group.url, waited))
+            if response.status == 304 and http_cache is not None:
+                entry = http_cache.get(group.url)
+                if entry is not None and all(key in entry.verdicts for key in cached_keys + changed_keys):
+                    log.debug("Site {} not modified, reusing previous verdicts".format(group.url))
+                    verdicts = {key: entry.verdicts[key] for key in cached_keys}
+                    content_fingerprints = {key: entry.verdicts[key] for key in changed_keys}
+                    self._compare_fingerprints(
+                        group.url, list(changed_watches.values()), content_fingerprints, verdicts, state,
+                    )
+                    return verdicts, None
+                raise LocalException("Unexpected 304 without cached verdict")
             if response.status > 499 or response.status < 400:
                 response.raise_for_status()
-            if url_config.watch_type == WatchType.TEXT:
-                return await self._check_text(response, url_config.value), await response.text()
-            else:
-                raise RuntimeError("Unexpected watch type {}".format(url_config.watch_type))
-
-    def _log_site_content(self, log_dir: Path, text: str, url_config: WatchURL):
-        log_dir.mkdir(parents=True, exist_ok=True)
-        n_try = 0
-        while True:
-            try_suffix = "-{}".format(n_try) if n_try else ""
-            log_file = log_dir / f"{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}{try_suffix}.log"
-            if not log_file.exists():
-                break
-        with open(log_file, "w") as f:
-            f.write("<!-- FROM {} -->\n\n".format(url_config.url))
-            f.write(text)
-
-    async def _check_url(self, target: WatchTarget, url_config: WatchURL):
-        log.info(f"Checking site {url_config.url} for '{url_config.value}' {url_config.watch_type}")
+
+            text_values = []
+            document_keys = []
+            for _, url_config in group.checks:
+                if url_config.watch_type == WatchType.TEXT:
+                    if url_config.value not in text_values:
+                        text_values.append(url_config.value)
+                elif url_config.watch_type != WatchType.CHANGED:
+                    key = self._verdict_key(url_config)
+                    if key not in document_keys:
+                        document_keys.append(key)
+            keep_body = any(target.log_dir is not None for target, _ in group.checks)
+            verdicts, content_fingerprints, body, fingerprint = await self._check_content(
+                response, group.url, text_values, document_keys, changed_keys, keep_body, state,
+            )
+
+            if http_cache is not None and response.status == 200:
+                http_cache.update(
+                    group.url, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                    {**{key: verdicts[key] for key in cached_keys}, **content_fingerprints}, fingerprint,
+                )
+            self._compare_fingerprints(
+                group.url, list(changed_watches.values()), content_fingerprints, verdicts, state,
+            )
+            return verdicts, body
+
+    def _archive(self, log_dir: Path) -> PageArchive:
+        if log_dir not in self._archives:
+            self._archives[log_dir] = PageArchive(log_dir)
+        return self._archives[log_dir]
+
+    async def _log_site_content(self, target: WatchTarget, body: bytes, url: yarl.URL):
+        digest = await asyncio.to_thread(self._archive(target.log_dir).store, target.name, str(url), body)
+        log.debug("Site {} content archived in {} as {}".format(url, target.log_dir, digest))
+
+    async def _prune_archives(self):
+        log_dirs = {target.log_dir for target in self._watcher_config.targets if target.log_dir is not None}
+        for log_dir in log_dirs:
+            if not log_dir.exists():
+                continue
+            archive = self._archive(log_dir)
+            try:
+                dropped = await asyncio.to_thread(
+                    archive.prune,
+                    max_age=self._config.site_watcher.log_max_age,
+                    max_size=self._config.site_watcher.log_max_size,
+                )
+                if dropped:
+                    log.info("Pruned {} entries from archive {}".format(dropped, archive.root))
+            except Exception:
+                log.exception("Exception while pruning archive {}".format(archive.root))
+
+    def _check_bounds(self, group: UrlGroup) -> Optional[tuple[timedelta, timedelta]]:
+        """Adaptive interval bounds for the url, the strictest of its targets. None if it is checked every run"""
+        config = self._config.site_watcher
+        max_intervals = [coalesce(target.max_check_interval, config.max_check_interval) for target, _ in group.checks]
+        if any(interval is None for interval in max_intervals):
+            return None
+        min_interval = min(coalesce(target.min_check_interval, config.min_check_interval) for target, _ in group.checks)
+        return min_interval, min(max_intervals)
+
+    def _record_outcome(self, group: UrlGroup, state: RunState, verdicts: Optional[dict[str, Optional[str]]]):
+        bounds = self._check_bounds(group)
+        if bounds is None:
+            return
+        signature = None
+        if verdicts is not None:
+            # Only verdicts count as a change, the raw body of a dynamic page differs on every read
+            notifying = sorted(key for key, verdict in verdicts.items() if verdict is not None)
+            signature = hashlib.sha1(json.dumps(notifying).encode()).hexdigest()
+        delay = state.schedule.record(
+            group.url, signature, *bounds, base_interval=self._config.daemon.site_watcher_interval,
+        )
+        log.debug("Site {}: next check in {}".format(group.url, delay))
+
+    async def _check_url(self, group: UrlGroup, state: RunState):
+        log.info("Checking site {} for {} values".format(group.url, len(group.checks)))
         try:
-            result, resp_text = await self._check_url_inner(target, url_config)
-            if result is not None:
-                log.info("Site {}: {}. Notifying".format(url_config.url, result))
-                try:
-                    if target.log_dir is not None:
-                        self._log_site_content(target.log_dir, resp_text, url_config)
-                except Exception:
-                    log.exception("Exception while saving site {} content".format(url_config.url))
-                await self._notify(target, url_config, result)
-            else:
-                log.debug("Site {}: no need to notify".format(url_config.url))
+            verdicts, body = await self._check_url_inner(group, state)
+        except Exception:
+            log.exception("Exception while checking url {}".format(group.url))
+            self._record_outcome(group, state, None)
+            return
+        self._record_outcome(group, state, verdicts)
+
+        # Every notified target gets its own index entry, the archive stores identical bodies once
+        archived_targets = set()
+        for target, url_config in group.checks:
+            try:
+                key = self._result_key(target, url_config)
+                if key not in verdicts:
+                    continue
+                result = verdicts[key]
+                if result is not None:
+                    log.info("Site {}: {}. Notifying {}".format(group.url, result, target.name))
+                    try:
+                        if target.log_dir is not None and body is not None and target.name not in archived_targets:
+                            archived_targets.add(target.name)
+                            await self._log_site_content(target, body, group.url)
+                    except Exception:
+                        log.exception("Exception while saving site {} content".format(group.url))
+                    await self._notify(target, url_config, result)
+                else:
+                    log.debug("Site {}: no need to notify {}".format(group.url, target.name))
+            except Exception:
+                log.exception("Exception while processing url {} for {}".format(group.url, target.name))
+
+    async def _get_http_cache(self) -> Optional[HttpValidatorCache]:
+        if not self._config.site_watcher.conditional_requests:
+            return None
+        try:
+            return await self._manager.get_http_cache()
         except Exception:
-            log.exception("Exception while checking url {}".format(url_config.url))
+            log.exception("Exception loading HTTP validator cache, fetching unconditionally")
+            return None
+
+    def _due_groups(self, state: RunState) -> list[UrlGroup]:
+        now = datetime.now()
+        result = []
+        for group in self._group_by_url(state.suspensions):
+            if self._check_bounds(group) is not None and not state.schedule.is_due(group.url, now):
+                log.debug("Site {} is not due for a check yet".format(group.url))
+                continue
+            result.append(group)
+        return result
+
+    def _group_by_url(self, suspensions: SuspensionChecker) -> list[UrlGroup]:
+        groups: dict[str, UrlGroup] = {}
+        for target in self._watcher_config.targets:
+            log.debug("Checking target {} {}".format(target.name, target.urls))
+            if not target.contacts:
+                log.warning("No contacts configured for watch '{}'".format(target.name))
+            for url_config in target.urls:
+                if suspensions.is_suspended(
+                    target.name, url_config.url, url_config.value, url_config.watch_type.value,
+                ):
+                    log.debug("Site is suspended, not checking '{}'".format(target.name))
+                    continue
+                group = groups.setdefault(str(url_config.url), UrlGroup(url=url_config.url))
+                group.checks.append((target, url_config))
+        return list(groups.values())
 
     async def run(self):
-        suspensions = await self._manager.get_suspensions()
+        state = RunState(
+            suspensions=await self._manager.get_suspensions(),
+            http_cache=await self._get_http_cache(),
+            fingerprints=await self._manager.get_fingerprints(),
+            schedule=await self._manager.get_check_schedule(),
+        )
         async with asyncio.TaskGroup() as task_group:
-            for target in self._watcher_config.targets:
-                log.debug("Checking target {} {}".format(target.name, target.urls))
-                if not target.contacts:
-                    log.warning("No contacts configured for watch '{}'".format(target.name))
-                for url_config in target.urls:
-                    if not suspensions.is_suspended(
-                        target.name, url_config.url, url_config.value, url_config.watch_type.value,
-                    ):
-                        task_group.create_task(self._check_url(target, url_config))
-                    else:
-                        log.debug("Site is suspended, not checking '{}'".format(target.name))
+            for group in self._due_groups(state):
+                task_group.create_task(self._check_url(group, state))
+        wait_times = self._limiter.pop_wait_times()
+        if wait_times:
+            log.info("Made {} requests, queue wait avg {:.2f}s max {:.2f}s".format(
+                len(wait_times), sum(wait_times) / len(wait_times), max(wait_times),
+            ))
+        if state.http_cache is not None:
+            try:
+                await self._manager.save_http_cache(state.http_cache)
+            except Exception:
+                log.exception("Exception saving HTTP validator cache")
+        try:
+            await self._manager.save_fingerprints(state.fingerprints)
+        except Exception:
+            log.exception("Exception saving page fingerprints")
+        try:
+            await self._manager.save_check_schedule(state.schedule)
+        except Exception:
+            log.exception("Exception saving check schedule")
+        await self._prune_archives()
 
     def __str__(self):
         return "SiteWatcher {} targets".format(len(self._watcher_config.targets))
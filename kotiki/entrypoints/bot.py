@@ -5,12 +5,24 @@ from pathlib import Path
 
 import uvicorn
 
-from kotiki.api.bot_api import app as bot_api_app, configure as configure_bot_api, cctl_manager
-from kotiki.core.api_client import FastAPIClient
+from kotiki.api.bot_api import (
+    CCTL_HEARTBEAT_INTERVAL,
+    CCTL_HEARTBEAT_MISSED,
+    app as bot_api_app,
+    configure as configure_bot_api,
+    cctl_manager,
+)
+from kotiki.core.api_client import CachingAPIClient, FastAPIClient
 from kotiki.commands.bot_commands import BotCommands
 from kotiki.core.bot import create_bot
+from kotiki.core.db import create_db
 from kotiki.core.log import setup_logging
+from kotiki.core.managers.notifications_manager import NotificationsManager
+from kotiki.core.metrics import MetricsReporter, metrics
 from kotiki.core.models.config import parse_config
+from kotiki.core.notification_consumer import NotificationConsumer, create_wakeup
+from kotiki.core.scheduler import Scheduler, ScheduledRunner
+from kotiki.cron.notification_executor import NotificationExecutor
 
 log = logging.getLogger("kotiki.entrypoints.bot")
 
@@ -26,7 +38,12 @@ async def bot_main():
 
     configure_bot_api(api_secret=config.api_secret)
 
-    sensors_api = FastAPIClient(config.sensors_api)
+    sensors_api = CachingAPIClient(
+        FastAPIClient(
+            config.sensors_api, timeout=config.sensors_api_timeout, max_connections=config.sensors_api_connections,
+        ),
+        config.sensors_cache,
+    )
     bot = create_bot(config)
     await bot.delete_webhook()
     bot_commands = BotCommands(config=config, sensors_api=sensors_api)
@@ -44,21 +61,45 @@ async def bot_main():
     cctl_manager.set_on_unsolicited_error(on_unsolicited_error)
 
     uvicorn_config = uvicorn.Config(
-        bot_api_app, host=config.api_ip, port=config.api_port, log_level="info"
+        bot_api_app, host=config.api_ip, port=config.api_port, log_level="info",
+        # Transport-level heartbeats drop dead legacy cctl sockets, which don't answer protocol pings
+        ws_ping_interval=CCTL_HEARTBEAT_INTERVAL,
+        ws_ping_timeout=CCTL_HEARTBEAT_INTERVAL * CCTL_HEARTBEAT_MISSED,
     )
     server = uvicorn.Server(uvicorn_config)
     api_task = asyncio.create_task(server.serve())
     log.info("Bot API listening on %s:%s", config.api_ip, config.api_port)
 
+    metrics_task = asyncio.create_task(
+        Scheduler([ScheduledRunner(MetricsReporter(metrics), config.metrics_log_interval)]).run(),
+    )
+    db = None
+    consumer_task = None
+    if config.notifications.push_delivery:
+        db = create_db(config=config)
+        notifications_manager = NotificationsManager(db=db)
+        consumer = NotificationConsumer(
+            config=config.notifications,
+            executor=NotificationExecutor(config=config, bot=bot, manager=notifications_manager),
+            wakeup=create_wakeup(db, config.notifications),
+        )
+        consumer_task = asyncio.create_task(consumer.run())
+        log.info("Push notification delivery started")
+
     try:
         log.info("Starting bot")
         await bot_commands.start_polling(bot)
     finally:
-        api_task.cancel()
-        try:
-            await api_task
-        except asyncio.CancelledError:
-            pass
+        for task in api_task, consumer_task, metrics_task:
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if db is not None:
+            await db.engine.dispose()
 
 
 if __name__ == "__main__":
@@ -12,8 +12,10 @@ from kotiki.core.interfaces import CronRunner
 from kotiki.core.log import setup_logging
 from kotiki.core.managers.notifications_manager import NotificationsManager
 from kotiki.core.managers.site_watcher_manager import SiteWatcherManager
+from kotiki.core.metrics import MetricsReporter, metrics
 from kotiki.core.models.config import parse_config
 from kotiki.core.models.site_watcher import parse_watch_config
+from kotiki.core.scheduler import Scheduler, ScheduledRunner
 from kotiki.cron.notification_executor import NotificationExecutor
 from kotiki.cron.site_watcher import SiteWatcher
 
@@ -28,6 +30,9 @@ async def cron_main():
     parser.add_argument(
         "--watch-config-file", type=Path, default=Path("site_watch.yml"),
     )
+    parser.add_argument(
+        "--daemon", action="store_true", help="Keep running and execute tasks on intervals from config",
+    )
 
     args = parser.parse_args()
 
@@ -39,31 +44,48 @@ async def cron_main():
     notifications_manager = NotificationsManager(db=db)
     site_watcher_manager = SiteWatcherManager(db=db)
 
-    async with aiohttp.ClientSession() as session:
-        executors: list[CronRunner] = []
-        if args.watch_config_file:
-            watcher_config = parse_watch_config(config_path=args.watch_config_file, config=config)
-            executors.append(
-                SiteWatcher(
+    try:
+        async with aiohttp.ClientSession() as session:
+            watcher = None
+            if args.watch_config_file:
+                watcher_config = parse_watch_config(config_path=args.watch_config_file, config=config)
+                watcher = SiteWatcher(
                     config=config,
                     watcher_config=watcher_config,
                     bot=bot,
                     session=session,
                     manager=site_watcher_manager,
-                    notifications_manager=notifications_manager,
-                ),
-            )
+                )
+            notification_executor = NotificationExecutor(config=config, bot=bot, manager=notifications_manager)
+
+            if args.daemon:
+                runners = [
+                    ScheduledRunner(notification_executor, config.daemon.notifications_interval),
+                    ScheduledRunner(MetricsReporter(metrics), config.metrics_log_interval),
+                ]
+                if watcher is not None:
+                    runners.insert(0, ScheduledRunner(watcher, config.daemon.site_watcher_interval))
+                scheduler = Scheduler(runners)
+                scheduler.install_signal_handlers()
+                log.info("Running in daemon mode")
+                await scheduler.run()
+                return
 
-        executors.append(
-            NotificationExecutor(config=config, bot=bot, manager=notifications_manager),
-        )
+            executors: list[CronRunner] = []
+            if watcher is not None:
+                executors.append(watcher)
+            executors.append(notification_executor)
+            executors.append(MetricsReporter(metrics))
 
-        for executor in executors:
-            log.debug("Running task {}".format(executor))
-            try:
-                await executor.run()
-            except Exception:
-                log.exception("Exception in executor {}".format(executor.__class__.__name__))
+            for executor in executors:
+                log.debug("Running task {}".format(executor))
+                try:
+                    await executor.run()
+                except Exception:
+                    log.exception("Exception in executor {}".format(executor.__class__.__name__))
+    finally:
+        await bot.session.close()
+        await db.engine.dispose()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from kotiki.core.api_client import CachingAPIClient
+from kotiki.core.models.config import SensorsCacheConfig
+
+
+class FakeUpstream:
+    """Counts requests, each answers with its sequence number after a delay"""
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.calls: list[str] = []
+        self.fail = False
+        self.closed = False
+
+    async def get(self, endpoint: str, params=None):
+        self.calls.append(endpoint)
+        number = len(self.calls)
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("upstream failed")
+        return {"endpoint": endpoint, "n": number}
+
+    async def close(self):
+        self.closed = True
+
+
+def _cache(upstream: FakeUpstream, **kwargs) -> CachingAPIClient:
+    return CachingAPIClient(upstream, SensorsCacheConfig(**kwargs))
+
+
+def test_concurrent_requests_share_one_upstream_call():
+    async def main():
+        upstream = FakeUpstream()
+        async with _cache(upstream) as cache:
+            results = await asyncio.gather(*(cache.get("/sensors") for _ in range(10)))
+            other = await cache.get("/sensors", params={"id": 1})
+        assert upstream.calls == ["/sensors", "/sensors"]
+        assert all(result["n"] == 1 for result in results)
+        assert other["n"] == 2
+        assert upstream.closed
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_others():
+    async def main():
+        upstream = FakeUpstream(delay=0.05)
+        cache = _cache(upstream)
+        first = asyncio.create_task(cache.get("/sensors"))
+        second = asyncio.create_task(cache.get("/sensors"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert (await second)["n"] == 1
+        assert len(upstream.calls) == 1
+
+    asyncio.run(main())
+
+
+def test_ttl_and_endpoint_ttls():
+    async def main():
+        upstream = FakeUpstream(delay=0)
+        cache = _cache(upstream, ttl=timedelta(seconds=0.05), endpoint_ttls={"/slow": timedelta(hours=1)})
+        assert (await cache.get("/fast"))["n"] == 1
+        assert (await cache.get("/slow"))["n"] == 2
+        assert (await cache.get("/fast"))["n"] == 1
+        await asyncio.sleep(0.06)
+        assert (await cache.get("/fast"))["n"] == 3
+        assert (await cache.get("/slow"))["n"] == 2
+
+    asyncio.run(main())
+
+
+def test_stale_while_revalidate():
+    async def main():
+        upstream = FakeUpstream()
+        cache = _cache(upstream, ttl=timedelta(seconds=0.05), stale_while_revalidate=timedelta(hours=1))
+        await cache.get("/sensors")
+        await asyncio.sleep(0.06)
+        stale = await asyncio.gather(*(cache.get("/sensors") for _ in range(5)))
+        assert all(result["n"] == 1 for result in stale)
+        await asyncio.sleep(0.05)
+        assert (await cache.get("/sensors"))["n"] == 2
+        assert len(upstream.calls) == 2
+
+    asyncio.run(main())
+
+
+def test_errors_are_not_cached():
+    async def main():
+        upstream = FakeUpstream()
+        cache = _cache(upstream)
+        upstream.fail = True
+        with pytest.raises(RuntimeError):
+            await cache.get("/sensors")
+        upstream.fail = False
+        assert (await cache.get("/sensors"))["n"] == 2
+
+    asyncio.run(main())
+
+
+def test_lru_eviction():
+    async def main():
+        upstream = FakeUpstream(delay=0)
+        cache = _cache(upstream, max_size=2)
+        await cache.get("/a")
+        await cache.get("/b")
+        await cache.get("/a")
+        await cache.get("/c")
+        assert (await cache.get("/a"))["n"] == 1
+        assert (await cache.get("/b"))["n"] == 4
+
+    asyncio.run(main())
+
+
+def test_disabled_cache_passes_through():
+    async def main():
+        upstream = FakeUpstream(delay=0)
+        cache = _cache(upstream, enabled=False)
+        await cache.get("/sensors")
+        await cache.get("/sensors")
+        assert len(upstream.calls) == 2
+
+    asyncio.run(main())
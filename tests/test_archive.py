@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from kotiki.core.archive import PageArchive
+
+
+def _objects(root: Path) -> list[Path]:
+    return sorted((root / PageArchive.OBJECTS_DIR).rglob("*.gz"))
+
+
+def test_repeated_content_is_stored_once_and_indexed_every_time(tmp_path: Path):
+    archive = PageArchive(tmp_path)
+    first = archive.store("target", "https://example.com", b"page")
+    second = archive.store("target", "https://example.com", b"page")
+    other = archive.store("other", "https://example.com", b"page")
+
+    assert first == second == other
+    assert len(_objects(tmp_path)) == 1
+    entries = archive.entries()
+    assert [(entry.target, entry.hash) for entry in entries] == [
+        ("target", first), ("target", first), ("other", first),
+    ]
+    assert len(archive.entries(target="target")) == 2
+    assert archive.read(first) == b"page"
+
+
+def test_prune_by_age_deletes_unreferenced_objects(tmp_path: Path):
+    archive = PageArchive(tmp_path)
+    old = archive.store("target", "url", b"old", time=datetime.now() - timedelta(days=10))
+    new = archive.store("target", "url", b"new")
+
+    assert archive.prune(max_age=timedelta(days=1)) == 1
+    assert [entry.hash for entry in archive.entries()] == [new]
+    assert len(_objects(tmp_path)) == 1
+    assert archive.read(new) == b"new"
+    assert not any(old[2:] in path.name for path in _objects(tmp_path))
+
+
+def test_prune_by_size_keeps_shared_object_while_referenced(tmp_path: Path):
+    archive = PageArchive(tmp_path)
+    archive.store("target", "url", b"a" * 1000)
+    archive.store("target", "url", b"b" * 1000)
+    shared = archive.store("target", "url", b"a" * 1000)
+
+    object_size = max(path.stat().st_size for path in _objects(tmp_path))
+    archive.prune(max_size=object_size)
+
+    assert [entry.hash for entry in archive.entries()] == [shared]
+    assert archive.read(shared) == b"a" * 1000
@@ -0,0 +1,76 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from kotiki.api import bot_api
+
+SECRET = "test"
+
+
+class FakeWebSocket:
+    """Accepts a connection, never receives anything; sends hang when stalled"""
+
+    def __init__(self, stalled: bool = False):
+        self.scope = {"subprotocols": []}
+        self.stalled = stalled
+        self.sent: list[str] = []
+        self.closed = asyncio.Event()
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def receive(self):
+        await self.closed.wait()
+        return {"type": "websocket.disconnect", "code": 1000}
+
+    async def send_text(self, frame: str):
+        if self.stalled:
+            await asyncio.Event().wait()
+        self.sent.append(frame)
+
+    async def close(self, code: int = 1000, reason: str | None = None):
+        self.closed.set()
+
+
+@pytest.fixture(autouse=True)
+def _configure(monkeypatch):
+    bot_api.configure(api_secret=SECRET)
+    monkeypatch.setattr(bot_api, "CCTL_SEND_TIMEOUT", 0.05)
+    monkeypatch.setattr(bot_api, "CCTL_RESPONSE_TIMEOUT", 0.05)
+    monkeypatch.setattr(bot_api, "cctl_manager", bot_api.CctlConnectionManager())
+
+
+async def _connect(client_id: str, websocket: FakeWebSocket) -> asyncio.Task:
+    digest = hashlib.sha1((SECRET + client_id).encode()).hexdigest()
+    handler = asyncio.create_task(bot_api.cctl_websocket(
+        websocket, digest, client_id, protocol=bot_api.CCTL_PROTOCOL_REQUEST_ID,
+    ))
+    while not bot_api.cctl_manager.live_connections(client_id):
+        await asyncio.sleep(0)
+    return handler
+
+
+def test_connection_with_timed_out_send_is_closed():
+    async def main():
+        stalled, healthy = FakeWebSocket(stalled=True), FakeWebSocket()
+        stalled_handler = await _connect("stalled", stalled)
+        healthy_handler = await _connect("healthy", healthy)
+
+        results = await bot_api.cctl_manager.broadcast({"start": True})
+
+        assert sorted((result["client_id"], result["error"]) for result in results) == [
+            ("healthy", "timeout"), ("stalled", "send timeout"),
+        ]
+        await asyncio.wait_for(stalled_handler, timeout=1)
+        assert stalled.closed.is_set()
+        assert [client_id for client_id, _ in bot_api.cctl_manager.live_connections()] == ["healthy"]
+        # An unanswered command is not a broken connection
+        assert not healthy.closed.is_set()
+        assert len(healthy.sent) == 1
+
+        await healthy.close()
+        await asyncio.wait_for(healthy_handler, timeout=1)
+        assert bot_api.cctl_manager.live_connections() == []
+
+    asyncio.run(main())
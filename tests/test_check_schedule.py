@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+import yarl
+
+from kotiki.core.managers.site_watcher_manager import CheckSchedule
+from kotiki.core.models.config import SiteWatcherConfig, parse_config
+
+URL = yarl.URL("https://example.com")
+DEFAULTS = SiteWatcherConfig()
+MIN = DEFAULTS.min_check_interval
+MAX = timedelta(hours=6)
+BASE = timedelta(minutes=5)
+
+
+def _record(schedule: CheckSchedule, signature: str | None) -> timedelta:
+    return schedule.record(URL, signature, MIN, MAX, base_interval=BASE)
+
+
+def test_interval_grows_from_default_minimum_while_unchanged():
+    schedule = CheckSchedule([])
+    delays = [_record(schedule, "same") for _ in range(4)]
+    assert delays[0] == BASE
+    assert delays == sorted(delays)
+    assert delays[-1] > delays[0]
+    assert delays[1] == BASE * CheckSchedule.BACKOFF
+
+
+def test_interval_is_capped_by_max():
+    schedule = CheckSchedule([])
+    for _ in range(50):
+        delay = _record(schedule, "same")
+    assert delay == MAX
+
+
+def test_interval_halves_on_change_down_to_min():
+    schedule = CheckSchedule([])
+    for _ in range(3):
+        grown = _record(schedule, "same")
+    assert _record(schedule, "changed") == grown / 2
+    for i in range(20):
+        delay = _record(schedule, str(i))
+    assert delay == MIN
+
+
+def test_error_retries_at_min_and_keeps_interval():
+    schedule = CheckSchedule([])
+    _record(schedule, "same")
+    assert _record(schedule, None) == MIN
+    [stats] = schedule.pop_dirty()
+    assert stats.errors == 1
+    assert stats.interval == BASE.total_seconds()
+
+
+def test_is_due():
+    schedule = CheckSchedule([])
+    assert schedule.is_due(URL, datetime.now())
+    _record(schedule, "same")
+    assert not schedule.is_due(URL, datetime.now())
+    assert schedule.is_due(URL, datetime.now() + BASE + timedelta(seconds=1))
+
+
+def test_zero_min_interval_is_rejected(tmp_path: Path):
+    with pytest.raises(ValueError):
+        CheckSchedule([]).record(URL, "same", timedelta(0), MAX, base_interval=BASE)
+
+    config_path = tmp_path / "config.yml"
+    config_path.write_text(
+        "bot_token: token\n"
+        "contacts: {}\n"
+        "db: {type: sqlite, path: db.sqlite3}\n"
+        "sensors_api: http://localhost\n"
+        "site_watcher: {min_check_interval: 0}\n"
+    )
+    with pytest.raises(ValueError, match="min_check_interval"):
+        parse_config(config_path)
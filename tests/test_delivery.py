@@ -0,0 +1,118 @@
+import asyncio
+from datetime import timedelta
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from kotiki.core.delivery import DeliveryEngine
+from kotiki.core.models.config import NotificationsConfig
+from kotiki.core.models.db import Notification
+
+
+class FakeBot:
+    """Records sent messages and the peak number of concurrent requests"""
+
+    def __init__(self, duration: float = 0.01, flood: dict[str, float] | None = None, broken: set[str] = ()):
+        self.duration = duration
+        # Chat id to retry_after of a single flood control error on its first message
+        self.flood = dict(flood or {})
+        self.broken = broken
+        self.sent: list[tuple[str, str]] = []
+        self.active = 0
+        self.peak = 0
+
+    async def send_message(self, chat_id: str, text: str):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.duration)
+            if chat_id in self.flood:
+                retry_after = self.flood.pop(chat_id)
+                raise TelegramRetryAfter(
+                    SendMessage(chat_id=chat_id, text=text), "Flood control exceeded", retry_after,
+                )
+            if text in self.broken:
+                raise RuntimeError("send failed")
+            self.sent.append((chat_id, text))
+        finally:
+            self.active -= 1
+
+
+class FakeManager:
+    def __init__(self):
+        self.acked: list[Notification] = []
+        self.failed: list[Notification] = []
+        self.released: list[Notification] = []
+
+    async def ack(self, notifications):
+        self.acked.extend(notifications)
+
+    async def fail(self, notifications, retry_delay):
+        self.failed.extend(notifications)
+
+    async def release(self, notifications):
+        self.released.extend(notifications)
+
+
+def _notification(id_: int, chat_id: str, message: str) -> Notification:
+    return Notification(id=id_, chat_id=chat_id, message=message, attempts=0, duplicates=0)
+
+
+def _config(**kwargs) -> NotificationsConfig:
+    kwargs.setdefault("chat_rate", 100.0)
+    kwargs.setdefault("global_rate", 100.0)
+    kwargs.setdefault("digest", False)
+    return NotificationsConfig(**kwargs)
+
+
+def test_flood_paused_chat_does_not_hold_concurrency_slot():
+    bot = FakeBot(flood={"1": 0.5})
+    manager = FakeManager()
+    engine = DeliveryEngine(_config(concurrency=1), bot, manager)
+    batch = [_notification(1, "1", "a")] + [_notification(i, "2", "b{}".format(i)) for i in range(2, 6)]
+
+    asyncio.run(engine.deliver(batch))
+
+    assert bot.peak == 1
+    # The other chat is fully sent during the first chat's flood pause
+    assert bot.sent[-1] == ("1", "a")
+    assert [text for chat_id, text in bot.sent if chat_id == "2"] == ["b2", "b3", "b4", "b5"]
+    assert sorted(n.id for n in manager.acked) == [1, 2, 3, 4, 5]
+
+
+def test_sends_to_different_chats_concurrently():
+    bot = FakeBot(duration=0.05)
+    engine = DeliveryEngine(_config(concurrency=3), bot, FakeManager())
+    asyncio.run(engine.deliver([_notification(i, str(i), "m") for i in range(6)]))
+    assert bot.peak == 3
+
+
+def test_failure_stops_chat_and_releases_unsent_rest():
+    bot = FakeBot(broken={"b"})
+    manager = FakeManager()
+    engine = DeliveryEngine(_config(), bot, manager)
+    batch = [_notification(i, "1", text) for i, text in enumerate("abc")] + [_notification(3, "2", "d")]
+
+    asyncio.run(engine.deliver(batch))
+
+    assert sorted(bot.sent) == [("1", "a"), ("2", "d")]
+    assert sorted(n.id for n in manager.acked) == [0, 3]
+    assert [n.id for n in manager.failed] == [1]
+    assert [n.id for n in manager.released] == [2]
+
+
+def test_digest_merges_chat_notifications():
+    bot = FakeBot()
+    engine = DeliveryEngine(_config(digest=True, max_message_length=5), bot, FakeManager())
+    asyncio.run(engine.deliver([_notification(i, "1", text) for i, text in enumerate(["a", "b", "cdef"])]))
+    assert bot.sent == [("1", "a\n\nb"), ("1", "cdef")]
+
+
+def test_releases_notifications_past_lease_deadline():
+    bot = FakeBot()
+    manager = FakeManager()
+    engine = DeliveryEngine(_config(lease_time=timedelta(0)), bot, manager)
+    asyncio.run(engine.deliver([_notification(1, "1", "a")]))
+    assert bot.sent == []
+    assert [n.id for n in manager.released] == [1]
+    assert manager.acked == manager.failed == []
@@ -0,0 +1,62 @@
+import asyncio
+
+from kotiki.core.host_limiter import HostLimiter
+
+
+async def _run_requests(limiter: HostLimiter, hosts: list[str], duration: float) -> dict[str, int]:
+    """Run one request per host entry, returns max concurrency seen globally and per host"""
+    active: dict[str, int] = {}
+    peaks: dict[str, int] = {}
+
+    async def request(host: str):
+        async with limiter.slot(host):
+            for key in host, "*":
+                active[key] = active.get(key, 0) + 1
+                peaks[key] = max(peaks.get(key, 0), active[key])
+            await asyncio.sleep(duration)
+            for key in host, "*":
+                active[key] -= 1
+
+    await asyncio.gather(*(request(host) for host in hosts))
+    return peaks
+
+
+def test_limits_global_and_per_host_concurrency():
+    limiter = HostLimiter(max_concurrency=3, per_host_concurrency=2, per_host_interval=0)
+    peaks = asyncio.run(_run_requests(limiter, ["a"] * 5 + ["b"] * 5 + ["c"] * 5, duration=0.01))
+    assert peaks["*"] == 3
+    assert all(peaks[host] <= 2 for host in "abc")
+
+
+def test_spaces_out_requests_to_same_host():
+    limiter = HostLimiter(max_concurrency=10, per_host_concurrency=10, per_host_interval=0.05)
+
+    async def main() -> list[float]:
+        loop = asyncio.get_running_loop()
+        starts = []
+
+        async def request():
+            async with limiter.slot("a"):
+                starts.append(loop.time())
+
+        await asyncio.gather(*(request() for _ in range(3)))
+        return starts
+
+    starts = sorted(asyncio.run(main()))
+    assert all(b - a >= 0.045 for a, b in zip(starts, starts[1:]))
+    wait_times = limiter.pop_wait_times()
+    assert len(wait_times) == 3
+    assert max(wait_times) >= 0.09
+    assert limiter.pop_wait_times() == []
+
+
+def test_other_hosts_are_not_delayed_by_a_busy_host():
+    limiter = HostLimiter(max_concurrency=10, per_host_concurrency=1, per_host_interval=1.0)
+
+    async def main() -> float:
+        async with limiter.slot("a"):
+            pass
+        async with limiter.slot("b") as waited:
+            return waited
+
+    assert asyncio.run(main()) < 0.05
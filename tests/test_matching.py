@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from kotiki.core.matching import (
+    BodyTooLargeException, ContentFingerprint, CssCheck, Document, JsonPathCheck, NeedleSet, RegexCheck,
+    StreamingMatcher, XPathCheck, _walk_json, compile_json_path, make_selector_check, scan_stream,
+)
+
+
+def _feed(matcher: StreamingMatcher, data: bytes, chunk_size: int) -> bool:
+    done = False
+    for start in range(0, len(data), chunk_size):
+        done = matcher.feed(data[start:start + chunk_size])
+    return done
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 100])
+def test_matcher_finds_needles_across_chunk_boundaries(chunk_size: int):
+    matcher = StreamingMatcher([b"hello", b"world", b"absent"])
+    assert not _feed(matcher, b"say hello to the world", chunk_size)
+    assert matcher.found == {b"hello", b"world"}
+
+
+def test_matcher_reports_needles_hidden_by_longer_ones():
+    # At the same position the longest needle wins, its prefixes and substrings are found too
+    matcher = StreamingMatcher([b"ab", b"abc", b"bc", b"c"])
+    assert matcher.feed(b"xabcx")
+    assert matcher.found == {b"ab", b"abc", b"bc", b"c"}
+
+
+def test_matcher_stops_when_everything_is_found():
+    matcher = StreamingMatcher([b"a", b"b"])
+    assert not matcher.feed(b"xxa")
+    assert matcher.feed(b"b")
+    assert matcher.done
+
+
+def test_compiled_needles_are_shared_between_scans():
+    needles = NeedleSet([b"abc"])
+    first, second = StreamingMatcher(needles), StreamingMatcher(needles)
+    assert first.feed(b"xxabcxx")
+    assert not second.feed(b"xxab")
+    assert second.feed(b"cxx")
+
+
+@pytest.mark.parametrize("needles", [[], [b""], [b"a", b""]])
+def test_empty_needles_are_rejected(needles: list[bytes]):
+    with pytest.raises(ValueError):
+        NeedleSet(needles)
+
+
+async def _chunks(data: bytes, chunk_size: int):
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+def test_scan_stream_stops_early_unless_reading_all():
+    data = b"needle" + b"x" * 100
+    scan = asyncio.run(scan_stream(_chunks(data, 10), StreamingMatcher([b"needle"]), max_size=1000, keep_body=True))
+    assert scan.size == 10
+    assert scan.body is None and scan.fingerprint is None
+
+    scan = asyncio.run(scan_stream(
+        _chunks(data, 10), StreamingMatcher([b"needle"]), max_size=1000, keep_body=False, read_all=True,
+    ))
+    assert scan.size == len(data)
+    assert scan.body == data
+    assert scan.fingerprint is not None
+
+
+def test_scan_stream_limits_body_size():
+    with pytest.raises(BodyTooLargeException):
+        asyncio.run(scan_stream(_chunks(b"x" * 100, 10), None, max_size=50, keep_body=False))
+
+
+@pytest.mark.parametrize("path, steps", [
+    ("$", []),
+    ("$.a.b_c-d", ["a", "b_c-d"]),
+    ("$['a b'][\"c\"]", ["a b", "c"]),
+    ("$.items[0][-1]", ["items", 0, -1]),
+    ("$.*[*].name", [None, None, "name"]),
+])
+def test_compile_json_path(path: str, steps: list):
+    assert compile_json_path(path) == steps
+
+
+@pytest.mark.parametrize("path", ["a.b", "$.", "$[", "$[a]", "$..a", "$.a b"])
+def test_compile_json_path_rejects_invalid_paths(path: str):
+    with pytest.raises(ValueError):
+        compile_json_path(path)
+
+
+def test_walk_json():
+    data = {"items": [{"name": "a"}, {"name": "b"}, {"other": "c"}], "count": 3}
+    assert _walk_json([data], "items") == [data["items"]]
+    assert _walk_json([data["items"]], -1) == [{"other": "c"}]
+    assert _walk_json([data["items"]], 3) == []
+    assert _walk_json([data["items"]], "name") == []
+    assert _walk_json([data], None) == [data["items"], 3]
+    assert _walk_json(data["items"], "name") == ["a", "b"]
+    assert _walk_json([3, "text"], None) == []
+
+
+def test_json_path_check():
+    document = Document(b'{"items": [{"status": "ok", "id": 1}, {"status": "down", "id": 2}]}', "utf-8")
+    assert JsonPathCheck("$.items[*].status", "down").check(document) is None
+    assert JsonPathCheck("$.items[*].id", "2").check(document) is None
+    assert JsonPathCheck("$.items[0].status", "down").check(document) is not None
+
+
+def test_document_checks():
+    document = Document("<html><body><p class='status'>All good</p><p>Price 10</p></body></html>".encode(), "utf-8")
+    assert RegexCheck(r"Price \d+").check(document) is None
+    assert RegexCheck(r"Price \d{3}").check(document) is not None
+    assert CssCheck("p.status", "good").check(document) is None
+    assert CssCheck("p.status", "Price").check(document) is not None
+    assert XPathCheck("//p[2]", "Price").check(document) is None
+    with pytest.raises(ValueError):
+        RegexCheck("(")
+
+
+def test_make_selector_check_detects_language():
+    assert isinstance(make_selector_check("$.a"), JsonPathCheck)
+    assert isinstance(make_selector_check("//p"), XPathCheck)
+    assert isinstance(make_selector_check("(//p)[1]"), XPathCheck)
+    assert isinstance(make_selector_check("div > p"), CssCheck)
+
+
+def _fingerprint(body: str, selector: str | None = None) -> str:
+    return ContentFingerprint(selector).fingerprint(Document(body.encode(), "utf-8"))
+
+
+def test_content_fingerprint_ignores_markup_scripts_and_attributes():
+    page = (
+        "<html><head><script>var ts = {0}</script><style>p {{ color: red }}</style></head>"
+        "<body><input name='csrf' value='{0}'><p>Price:  <b>10</b></p></body></html>"
+    )
+    assert _fingerprint(page.format(1)) == _fingerprint(page.format(2))
+    assert _fingerprint(page.format(1)) != _fingerprint(page.format(1).replace("10", "11"))
+
+
+def test_content_fingerprint_of_selected_content():
+    page = "<html><body><p class='ts'>{}</p><div id='price'>{}</div></body></html>"
+    for selector in "#price", "//div[@id='price']":
+        assert _fingerprint(page.format(1, 10), selector) == _fingerprint(page.format(2, 10), selector)
+        assert _fingerprint(page.format(1, 10), selector) != _fingerprint(page.format(1, 11), selector)
+    assert _fingerprint('{"price": 10, "ts": 1}', "$.price") == _fingerprint('{"price": 10, "ts": 2}', "$.price")
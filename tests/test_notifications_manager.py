@@ -0,0 +1,78 @@
+import asyncio
+from datetime import timedelta
+from pathlib import Path
+
+from kotiki.core.db import DB
+from kotiki.core.managers.notifications_manager import NotificationsManager
+from kotiki.core.models.config import Config, SqliteConfig
+from kotiki.core.models.db import Base, Notification
+
+LEASE = timedelta(minutes=5)
+RETRY_DELAY = timedelta(seconds=30)
+
+
+async def _manager(path: Path) -> NotificationsManager:
+    db = DB(Config(
+        bot_token="token", contacts={}, db=SqliteConfig(type="sqlite", path=path), sensors_api="http://localhost",
+    ))
+    async with db.engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    return NotificationsManager(db)
+
+
+async def _add(manager: NotificationsManager, chat_id: str, message: str) -> int:
+    return await manager.add(Notification(chat_id=chat_id, message=message))
+
+
+def test_claim_skips_chat_until_failed_notification_is_due(tmp_path: Path):
+    async def main():
+        manager = await _manager(tmp_path / "db.sqlite3")
+        try:
+            failing = await _add(manager, "1", "first")
+            rest = await _add(manager, "1", "second")
+            other = await _add(manager, "2", "other")
+
+            claimed = await manager.claim(10, LEASE)
+            assert [n.id for n in claimed] == [failing, rest, other]
+            # The first send of chat 1 failed, the second was not attempted
+            await manager.fail([claimed[0]], retry_delay=RETRY_DELAY)
+            await manager.release([claimed[1]])
+            await manager.ack([claimed[2]])
+            later = await _add(manager, "1", "third")
+            other = await _add(manager, "2", "other again")
+
+            assert [n.id for n in await manager.claim(10, LEASE)] == [other]
+
+            async with manager.db.session() as session:
+                row = await session.get(Notification, failing)
+                row.next_attempt_at -= RETRY_DELAY
+                await session.commit()
+            claimed = await manager.claim(10, LEASE)
+            assert [n.id for n in claimed] == [failing, rest, later]
+            assert [n.attempts for n in claimed] == [1, 0, 0]
+        finally:
+            await manager.db.engine.dispose()
+
+    asyncio.run(main())
+
+
+def test_fail_backs_off_by_attempt(tmp_path: Path):
+    async def main():
+        manager = await _manager(tmp_path / "db.sqlite3")
+        try:
+            await _add(manager, "1", "message")
+            for attempts in range(1, 4):
+                [notification] = await manager.claim(10, LEASE)
+                await manager.fail([notification], retry_delay=RETRY_DELAY)
+                async with manager.db.session() as session:
+                    row = await session.get(Notification, notification.id)
+                    assert row.attempts == attempts
+                    assert row.leased_until is None
+                    delay = row.next_attempt_at - row.first_attempt_at
+                    assert RETRY_DELAY * 2 ** (attempts - 1) <= delay < RETRY_DELAY * 2 ** attempts
+                    row.next_attempt_at = row.first_attempt_at
+                    await session.commit()
+        finally:
+            await manager.db.engine.dispose()
+
+    asyncio.run(main())
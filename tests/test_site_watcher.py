@@ -0,0 +1,153 @@
+import asyncio
+import contextlib
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import aiohttp
+import pytest
+import yarl
+from aiohttp import web
+from sqlalchemy import delete, select
+
+from kotiki.core.db import DB
+from kotiki.core.managers.site_watcher_manager import SiteWatcherManager
+from kotiki.core.models.config import Config, Contact, SiteWatcherConfig, SqliteConfig
+from kotiki.core.models.db import Base, Notification, SiteWatchSuspension, SiteWatchUrlStats
+from kotiki.core.models.site_watcher import WatcherConfig, WatchTarget, WatchType, WatchURL
+from kotiki.cron.site_watcher import SiteWatcher
+
+
+class Site:
+    """Page with a versioned content and a random token on every response, answers 304 with use_etag"""
+
+    def __init__(self, use_etag: bool):
+        self.use_etag = use_etag
+        self.version = 1
+        self.requests = 0
+
+    async def page(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        etag = '"v{}"'.format(self.version)
+        headers = {"ETag": etag} if self.use_etag else {}
+        if self.use_etag and request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers=headers)
+        token = random.random()
+        body = (
+            "<html><head><script>var ts = {0}</script></head><body><input name='csrf' value='{0}'>"
+            "<p>version {1}</p></body></html>"
+        ).format(token, self.version)
+        return web.Response(text=body, content_type="text/html", headers=headers)
+
+
+@contextlib.asynccontextmanager
+async def _serve(site: Site):
+    app = web.Application()
+    app.add_routes([web.get("/page", site.page)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    try:
+        yield yarl.URL("http://127.0.0.1:{}/page".format(runner.addresses[0][1]))
+    finally:
+        await runner.cleanup()
+
+
+class Watch:
+    def __init__(self, tmp_path: Path, url: yarl.URL, targets: list[WatchTarget], **config):
+        self.config = Config(
+            bot_token="token", contacts={"me": Contact(id="1")},
+            db=SqliteConfig(type="sqlite", path=tmp_path / "db.sqlite3"), sensors_api="http://localhost", **config,
+        )
+        self.db = DB(self.config)
+        self.url = url
+        self.watcher_config = WatcherConfig(targets=targets)
+
+    async def setup(self):
+        async with self.db.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+    async def run(self, session: aiohttp.ClientSession, suspended: tuple[str, ...] = ()) -> list[str]:
+        """Run the watcher with only the given targets suspended, returns queued messages"""
+        async with self.db.session() as db_session:
+            await db_session.execute(delete(SiteWatchSuspension))
+            for target in suspended:
+                db_session.add(SiteWatchSuspension(
+                    target=target, url=str(self.url), watch_type=WatchType.CHANGED.value, value="",
+                    suspended_until=datetime.now() + timedelta(days=1),
+                ))
+            await db_session.commit()
+        manager = SiteWatcherManager(self.db)
+        watcher = SiteWatcher(self.config, self.watcher_config, None, session, manager)
+        await watcher.run()
+        async with self.db.session() as db_session:
+            messages = list((await db_session.execute(select(Notification.message))).scalars())
+            await db_session.execute(delete(Notification))
+            await db_session.commit()
+        return [message.split(" since ")[0] for message in messages]
+
+
+@pytest.mark.parametrize("use_etag", [False, True])
+def test_changed_watch_reports_change_made_while_suspended(tmp_path: Path, use_etag: bool):
+    async def main():
+        site = Site(use_etag)
+        async with _serve(site) as url:
+            await _check_changes(tmp_path, site, url)
+        assert site.requests == 5
+
+    asyncio.run(main())
+
+
+async def _check_changes(tmp_path: Path, site: Site, url: yarl.URL):
+    watch = Watch(tmp_path, url, [
+        WatchTarget(name="changes", contacts=["me"], urls=[WatchURL(url=url, watch_type=WatchType.CHANGED)]),
+        WatchTarget(name="other", contacts=["me"], urls=[
+            WatchURL(url=url, watch_type=WatchType.REGEX, value="version"),
+            WatchURL(url=url, watch_type=WatchType.CHANGED),
+        ]),
+    ])
+    await watch.setup()
+    try:
+        async with aiohttp.ClientSession() as session:
+            assert await watch.run(session) == []
+            # Only the token changed
+            assert await watch.run(session) == []
+            site.version = 2
+            # The other target sees the change while the first target's watch is suspended
+            assert await watch.run(session, suspended=("changes",)) == [
+                "other: Site {}: Content changed".format(url),
+            ]
+            assert await watch.run(session) == ["changes: Site {}: Content changed".format(url)]
+            assert await watch.run(session) == []
+    finally:
+        await watch.db.engine.dispose()
+
+
+def test_dynamic_page_is_checked_less_often(tmp_path: Path):
+    async def main():
+        site = Site(use_etag=False)
+        async with _serve(site) as url:
+            watch = Watch(
+                tmp_path, url,
+                [WatchTarget(name="t", contacts=["me"], urls=[
+                    WatchURL(url=url, watch_type=WatchType.REGEX, value="version"),
+                ])],
+                site_watcher=SiteWatcherConfig(max_check_interval=timedelta(days=1)),
+            )
+            await watch.setup()
+            intervals = []
+            try:
+                async with aiohttp.ClientSession() as session:
+                    for _ in range(3):
+                        await watch.run(session)
+                        async with watch.db.session() as db_session:
+                            [stats] = (await db_session.execute(select(SiteWatchUrlStats))).scalars()
+                            intervals.append(stats.interval)
+                            stats.next_check_at = datetime.now()
+                            await db_session.commit()
+            finally:
+                await watch.db.engine.dispose()
+        assert site.requests == 3
+        assert intervals[0] < intervals[1] < intervals[2]
+
+    asyncio.run(main())